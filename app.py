@@ -7,14 +7,23 @@ import os
 import sys
 import re
 import json
-import uuid
+import itertools
+import collections
+import codecs
+import secrets
+import asyncio
 import signal
 import subprocess
 import threading
+import queue
 import time
-from datetime import datetime
 from flask import Flask, render_template, request, jsonify, Response
 
+try:
+    import orjson  # optional — C JSON encoder for /api/status and SSE frames
+except ImportError:
+    orjson = None
+
 # ===== FIX WINDOWS UNICODE =====
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -26,29 +35,189 @@ WORK_DIR = os.path.dirname(os.path.abspath(__file__))
 # ============================================================
 #  PROCESS MANAGER
 # ============================================================
-processes = {}  # task_id -> {process, logs, status, script}
-logs_lock = threading.Lock()
+MAX_LOG_LINES = 20000  # per-task cap, oldest lines are dropped first
+SSE_BATCH_SIZE = 200  # max log entries coalesced into one SSE frame
+SSE_KEEPALIVE = 15  # seconds of silence before an SSE keepalive comment
+TASK_TTL = 3600  # finished tasks are forgotten after 1 hour
+REAP_INTERVAL = 60
 
+processes = {}  # task_id -> {process, logs, seq, lock, subs, status, script, finished_at}
+processes_lock = threading.RLock()  # guards insert/lookup in processes only
+_reaper = None
 
-def stream_output(task_id, pipe, label):
-    """Read subprocess output line by line and append to logs."""
-    try:
-        for line in iter(pipe.readline, ''):
-            if not line:
-                break
-            line = line.rstrip('\n').rstrip('\r')
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            entry = {"time": timestamp, "type": label, "msg": line}
-            with logs_lock:
-                if task_id in processes:
-                    processes[task_id]["logs"].append(entry)
-    except Exception:
-        pass
-    finally:
-        pipe.close()
+
+def new_task(task_id, script, msg):
+    """Register a running task with its first system log line."""
+    task = {
+        "process": None,
+        "logs": collections.deque(maxlen=MAX_LOG_LINES),
+        "seq": 0,  # total entries ever appended (logs may have dropped old ones)
+        "lock": threading.Lock(),  # guards logs/seq/status/subs of this task
+        "subs": [],  # one SimpleQueue per open SSE stream, fed by append_logs
+        "status": "running",
+        "script": script,
+        "finished_at": None,  # time.monotonic() when status became done/error
+    }
+    global _reaper
+    with processes_lock:
+        processes[task_id] = task
+        if _reaper is None:
+            _reaper = threading.Thread(target=reap_tasks, daemon=True)
+            _reaper.start()
+    append_log(task_id, {
+        "time": now_ts(),
+        "type": "system",
+        "msg": msg
+    })
+    return task
 
 
-def run_script(task_id, cmd, env=None):
+_ts_cache = [0, ""]  # [epoch second, formatted "%H:%M:%S"]
+
+
+def now_ts():
+    """Current time as "%H:%M:%S", formatted at most once per second."""
+    sec = int(time.time())
+    cache = _ts_cache
+    if cache[0] != sec:
+        cache[1] = time.strftime("%H:%M:%S", time.localtime(sec))
+        cache[0] = sec
+    return cache[1]
+
+
+def dumps(obj):
+    """Encode obj as UTF-8 JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+def get_task(task_id):
+    with processes_lock:
+        return processes.get(task_id)
+
+
+def append_log(task_id, entry, status=None):
+    """Append a log entry (optionally setting a new status) and push it to SSE readers."""
+    append_logs(task_id, [entry], status)
+
+
+def append_logs(task_id, entries, status=None):
+    """Append a batch of log entries under a single lock acquisition."""
+    task = get_task(task_id)
+    if task is None:
+        return
+    # The lock is not optional even though deque.extend is atomic: readers
+    # iterate the deque (which raises if it is mutated mid-iteration) and
+    # need logs and seq to move together once old entries start dropping.
+    with task["lock"]:
+        task["logs"].extend(entries)
+        task["seq"] += len(entries)
+        if status:
+            task["status"] = status
+            if status in ("done", "error"):
+                task["finished_at"] = time.monotonic()
+        for q in task["subs"]:
+            q.put((entries, status))
+
+
+def reap_tasks():
+    """Background thread: drop tasks that finished more than TASK_TTL ago."""
+    while True:
+        time.sleep(REAP_INTERVAL)
+        cutoff = time.monotonic() - TASK_TTL
+        with processes_lock:
+            for tid, task in list(processes.items()):
+                proc = task["process"]
+                # A stopped task keeps its entry until the process has really exited
+                if proc is not None and proc.returncode is None:
+                    continue
+                if task["finished_at"] is not None and task["finished_at"] < cutoff:
+                    del processes[tid]
+
+
+def tail_logs(task, n):
+    """Last n entries of a task's logs, oldest first. Caller holds task["lock"]."""
+    if n <= 0:
+        return []
+    tail = list(itertools.islice(reversed(task["logs"]), n))
+    tail.reverse()
+    return tail
+
+
+# Every subprocess runs on one background asyncio loop: a single OS thread
+# pumps the pipes of all running tasks (Proactor loop on Windows, epoll/kqueue elsewhere).
+_loop = None
+_loop_lock = threading.Lock()
+_NEWLINE_RE = re.compile(r'\r\n|\r|\n')  # same line endings as text-mode universal newlines
+PIPE_READ_SIZE = 256 * 1024  # asyncio pipe transports read up to 256 KiB per wakeup
+
+
+def use_pidfd_watcher(loop):
+    """Reap children from the loop itself via pidfds (Linux 5.3+, Python < 3.12).
+
+    The default ThreadedChildWatcher before 3.12 parks one waitpid() thread per
+    child; a PidfdChildWatcher registers each child's pidfd with the same
+    epoll loop instead. Python 3.12+ already picks pidfds on its own.
+    """
+    if sys.platform != 'linux' or sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return  # kernel without pidfd support
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+
+def get_loop():
+    """Return the subprocess event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            use_pidfd_watcher(_loop)
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+def split_lines(buf):
+    """Split decoded pipe text into complete lines plus the unfinished tail."""
+    # A trailing \r may be the first half of \r\n — keep it until the next read
+    hold = buf.endswith('\r')
+    lines = _NEWLINE_RE.split(buf[:-1] if hold else buf)
+    rest = lines.pop()
+    return lines, (rest + '\r' if hold else rest)
+
+
+def emit_lines(task_id, label, lines):
+    """Append every line from one pipe read as a single batch."""
+    if not lines:
+        return
+    timestamp = now_ts()
+    append_logs(task_id, [
+        {"time": timestamp, "type": label, "msg": line}
+        for line in lines
+    ])
+
+
+async def pump(task_id, stream, label):
+    """Read a subprocess pipe until EOF and append its lines to the task log."""
+    # Decode each chunk in one call; the incremental decoder carries a UTF-8
+    # sequence split across two reads over to the next chunk
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    buf = ''
+    while chunk := await stream.read(PIPE_READ_SIZE):
+        lines, buf = split_lines(buf + decoder.decode(chunk))
+        emit_lines(task_id, label, lines)
+    # EOF — flush the last unterminated line
+    tail = (buf + decoder.decode(b'', final=True)).rstrip('\r')
+    if tail:
+        emit_lines(task_id, label, [tail])
+
+
+async def launch(task_id, cmd, env=None):
     """Run a script in subprocess and capture output."""
     merged_env = os.environ.copy()
     if env:
@@ -58,54 +227,57 @@ def run_script(task_id, cmd, env=None):
     merged_env["PYTHONIOENCODING"] = "utf-8"
 
     try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             cwd=WORK_DIR,
             env=merged_env,
+            # Own process group/session so stop_task's killpg hits only this task.
+            # No preexec_fn: CPython keeps its vfork()/posix_spawn fast path.
             creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if sys.platform == 'win32' else 0,
+            start_new_session=sys.platform != 'win32',
         )
     except Exception as e:
-        with logs_lock:
-            processes[task_id]["logs"].append({
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "type": "stderr",
-                "msg": f"❌ Failed to start process: {e}"
-            })
-            processes[task_id]["status"] = "error"
+        append_log(task_id, {
+            "time": now_ts(),
+            "type": "stderr",
+            "msg": f"❌ Failed to start process: {e}"
+        }, status="error")
         return
 
-    processes[task_id]["process"] = proc
-
-    t_out = threading.Thread(target=stream_output, args=(task_id, proc.stdout, "stdout"), daemon=True)
-    t_err = threading.Thread(target=stream_output, args=(task_id, proc.stderr, "stderr"), daemon=True)
-    t_out.start()
-    t_err.start()
-
-    proc.wait()
-    t_out.join(timeout=3)
-    t_err.join(timeout=3)
-
-    exit_code = proc.returncode
-    with logs_lock:
-        if task_id in processes:
-            ts = datetime.now().strftime("%H:%M:%S")
-            if exit_code == 0:
-                processes[task_id]["status"] = "done"
-                processes[task_id]["logs"].append({
-                    "time": ts, "type": "system",
-                    "msg": f"✅ Hoàn tất (exit code: {exit_code})"
-                })
-            else:
-                processes[task_id]["status"] = "error"
-                processes[task_id]["logs"].append({
-                    "time": ts, "type": "system",
-                    "msg": f"❌ Lỗi (exit code: {exit_code})"
-                })
+    task = get_task(task_id)
+    if task is not None:
+        task["process"] = proc
+
+    # Both pipes reach EOF before the exit status is logged, so every line the
+    # script wrote is in the log before SSE readers see done/error
+    await asyncio.gather(
+        pump(task_id, proc.stdout, "stdout"),
+        pump(task_id, proc.stderr, "stderr"),
+    )
+    exit_code = await proc.wait()
+
+    ts = now_ts()
+    if exit_code == 0:
+        append_log(task_id, {
+            "time": ts, "type": "system",
+            "msg": f"✅ Hoàn tất (exit code: {exit_code})"
+        }, status="done")
+    else:
+        append_log(task_id, {
+            "time": ts, "type": "system",
+            "msg": f"❌ Lỗi (exit code: {exit_code})"
+        }, status="error")
+
+
+def run_script(task_id, cmd, env=None):
+    """Schedule a script on the subprocess loop. Returns immediately."""
+    return asyncio.run_coroutine_threadsafe(launch(task_id, cmd, env), get_loop())
+
+
+_FOLDER_URL_RE = re.compile(r'/folders/([a-zA-Z0-9_-]+)')
+_RAW_ID_RE = re.compile(r'^[a-zA-Z0-9_-]{10,}$')
 
 
 def parse_folder_id(gdrive_link):
@@ -113,13 +285,13 @@ def parse_folder_id(gdrive_link):
     if not gdrive_link:
         return None
     # Full URL: https://drive.google.com/drive/folders/XXXXX...
-    m = re.search(r'/folders/([a-zA-Z0-9_-]+)', gdrive_link)
+    m = _FOLDER_URL_RE.search(gdrive_link)
     if m:
         return m.group(1)
     # Raw ID (alphanumeric + - + _)
-    m = re.match(r'^[a-zA-Z0-9_-]{10,}$', gdrive_link.strip())
-    if m:
-        return gdrive_link.strip()
+    raw = gdrive_link.strip()
+    if _RAW_ID_RE.match(raw):
+        return raw
     return None
 
 
@@ -141,74 +313,28 @@ def run_getlinks():
     if not folder_id:
         return jsonify({"error": "Không tìm được Folder ID từ link. Hãy nhập link GDrive folder hợp lệ."}), 400
 
-    task_id = str(uuid.uuid4())[:8]
-    processes[task_id] = {
-        "process": None,
-        "logs": [{
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "type": "system",
-            "msg": f"🚀 Bắt đầu GetLinks — Folder ID: {folder_id}" + (f" — Tên: {folder_name}" if folder_name else "")
-        }],
-        "status": "running",
-        "script": "getlinks"
-    }
-
-    def run_and_rename(task_id, cmd, env, folder_name):
-        """Run getlinks.py then update root name in output.json."""
-        run_script(task_id, cmd, env=env)
-        # After script finishes, update root name if provided
-        if folder_name and processes.get(task_id, {}).get('status') == 'done':
-            output_path = os.path.join(WORK_DIR, 'output.json')
-            try:
-                with open(output_path, 'r', encoding='utf-8') as f:
-                    tree = json.load(f)
-                tree['name'] = folder_name
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    json.dump(tree, f, ensure_ascii=False, indent=2)
-                with logs_lock:
-                    processes[task_id]['logs'].append({
-                        'time': datetime.now().strftime('%H:%M:%S'),
-                        'type': 'system',
-                        'msg': f'📝 Đã đổi tên folder gốc → "{folder_name}"'
-                    })
-            except Exception as e:
-                with logs_lock:
-                    processes[task_id]['logs'].append({
-                        'time': datetime.now().strftime('%H:%M:%S'),
-                        'type': 'stderr',
-                        'msg': f'⚠️ Không sửa được tên root: {e}'
-                    })
-
-    thread = threading.Thread(
-        target=run_and_rename,
-        args=(task_id, [sys.executable, 'getlinks.py'], {'FOLDER_ID': folder_id}, folder_name),
-        daemon=True
+    task_id = secrets.token_hex(4)
+    new_task(
+        task_id, "getlinks",
+        f"🚀 Bắt đầu GetLinks — Folder ID: {folder_id}" + (f" — Tên: {folder_name}" if folder_name else "")
     )
-    thread.start()
+
+    # getlinks.py writes the root name itself, so output.json is never rewritten here
+    env = {'FOLDER_ID': folder_id}
+    if folder_name:
+        env['ROOT_NAME'] = folder_name
+
+    run_script(task_id, [sys.executable, 'getlinks.py'], env)
 
     return jsonify({"task_id": task_id, "folder_id": folder_id})
 
 
 @app.route('/api/run/remove', methods=['POST'])
 def run_remove():
-    task_id = str(uuid.uuid4())[:8]
-    processes[task_id] = {
-        "process": None,
-        "logs": [{
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "type": "system",
-            "msg": "🧹 Bắt đầu Remove — Xóa các mục không cần thiết"
-        }],
-        "status": "running",
-        "script": "remove"
-    }
+    task_id = secrets.token_hex(4)
+    new_task(task_id, "remove", "🧹 Bắt đầu Remove — Xóa các mục không cần thiết")
 
-    thread = threading.Thread(
-        target=run_script,
-        args=(task_id, [sys.executable, 'remove.py']),
-        daemon=True
-    )
-    thread.start()
+    run_script(task_id, [sys.executable, 'remove.py'])
 
     return jsonify({"task_id": task_id})
 
@@ -222,56 +348,71 @@ def run_sync():
     if dry_run:
         cmd.append('--dry-run')
 
-    task_id = str(uuid.uuid4())[:8]
+    task_id = secrets.token_hex(4)
     mode_label = "DRY-RUN" if dry_run else "LIVE"
-    processes[task_id] = {
-        "process": None,
-        "logs": [{
-            "time": datetime.now().strftime("%H:%M:%S"),
-            "type": "system",
-            "msg": f"🔄 Bắt đầu Sync GDrive — Mode: {mode_label}"
-        }],
-        "status": "running",
-        "script": "sync"
-    }
+    new_task(task_id, "sync", f"🔄 Bắt đầu Sync GDrive — Mode: {mode_label}")
 
-    thread = threading.Thread(
-        target=run_script,
-        args=(task_id, cmd),
-        daemon=True
-    )
-    thread.start()
+    run_script(task_id, cmd)
 
     return jsonify({"task_id": task_id})
 
 
+_SSE_PRE = b"data: "
+_SSE_POST = b"\n\n"
+_SSE_KEEPALIVE = b": ka\n\n"
+
+
+def sse_frame(obj):
+    return b"".join((_SSE_PRE, dumps(obj), _SSE_POST))
+
+
 @app.route('/api/logs/<task_id>')
 def stream_logs(task_id):
     """SSE endpoint — stream logs in real-time."""
     def generate():
-        last_idx = 0
-        while True:
-            with logs_lock:
-                task = processes.get(task_id)
-                if not task:
-                    yield f"data: {json.dumps({'type': 'error', 'msg': 'Task not found'})}\n\n"
-                    return
-
-                logs = task["logs"]
-                status = task["status"]
-
-                # Send new log entries
-                while last_idx < len(logs):
-                    entry = logs[last_idx]
-                    yield f"data: {json.dumps(entry, ensure_ascii=False)}\n\n"
-                    last_idx += 1
+        task = get_task(task_id)
+        if not task:
+            yield sse_frame({'type': 'error', 'msg': 'Task not found'})
+            return
+
+        # Seed this stream's queue with the backlog, then let writers feed it
+        q = queue.SimpleQueue()
+        with task["lock"]:
+            status = task["status"]
+            q.put((list(task["logs"]), status if status in ("done", "error") else None))
+            task["subs"].append(q)
+
+        try:
+            while True:
+                try:
+                    pending, status = q.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    # Idle — comment line keeps proxies from closing the stream
+                    yield _SSE_KEEPALIVE
+                    continue
+
+                # Coalesce everything else already queued into the same write
+                pending = list(pending)
+                while status not in ("done", "error"):
+                    try:
+                        entries, status = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    pending.extend(entries)
+
+                if pending:
+                    yield b"".join(
+                        sse_frame({'batch': pending[i:i + SSE_BATCH_SIZE]})
+                        for i in range(0, len(pending), SSE_BATCH_SIZE)
+                    )
 
                 # If done/error, send final status and close
                 if status in ("done", "error"):
-                    yield f"data: {json.dumps({'type': 'status', 'status': status})}\n\n"
+                    yield sse_frame({'type': 'status', 'status': status})
                     return
-
-            time.sleep(0.3)
+        finally:
+            with task["lock"]:
+                task["subs"].remove(q)
 
     return Response(
         generate(),
@@ -285,44 +426,46 @@ def stream_logs(task_id):
 
 @app.route('/api/stop/<task_id>', methods=['POST'])
 def stop_task(task_id):
-    with logs_lock:
-        task = processes.get(task_id)
-        if not task:
-            return jsonify({"error": "Task not found"}), 404
-        proc = task.get("process")
-        if proc and proc.poll() is None:
-            try:
-                if sys.platform == 'win32':
-                    proc.terminate()
-                else:
-                    os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
-                task["status"] = "error"
-                task["logs"].append({
-                    "time": datetime.now().strftime("%H:%M:%S"),
-                    "type": "system",
-                    "msg": "⛔ Đã dừng process"
-                })
-            except Exception as e:
-                return jsonify({"error": str(e)}), 500
-        return jsonify({"ok": True})
+    task = get_task(task_id)
+    if not task:
+        return jsonify({"error": "Task not found"}), 404
+    proc = task.get("process")
+    if proc and proc.returncode is None:
+        try:
+            if sys.platform == 'win32':
+                get_loop().call_soon_threadsafe(proc.terminate)
+            else:
+                os.killpg(os.getpgid(proc.pid), signal.SIGTERM)
+            append_log(task_id, {
+                "time": now_ts(),
+                "type": "system",
+                "msg": "⛔ Đã dừng process"
+            }, status="error")
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+    return jsonify({"ok": True})
 
 
 @app.route('/api/status')
 def get_status():
     """Get status of all tasks — includes recent logs for UI recovery."""
     result = {}
-    with logs_lock:
-        for tid, task in processes.items():
+    with processes_lock:
+        tasks = list(processes.items())
+    for tid, task in tasks:
+        # Hold each task's lock only long enough to copy its status and log tail
+        with task["lock"]:
+            status, log_count = task["status"], task["seq"]
             # Return last 50 log lines so frontend can show recent output
-            recent_logs = task["logs"][-50:]
-            result[tid] = {
-                "task_id": tid,
-                "status": task["status"],
-                "script": task["script"],
-                "log_count": len(task["logs"]),
-                "logs": recent_logs,
-            }
-    return jsonify(result)
+            recent_logs = tail_logs(task, 50)
+        result[tid] = {
+            "task_id": tid,
+            "status": status,
+            "script": task["script"],
+            "log_count": log_count,
+            "logs": recent_logs,
+        }
+    return Response(dumps(result), mimetype='application/json')
 
 
 if __name__ == '__main__':
@@ -19,98 +19,192 @@ import sys
 import time
 import subprocess
 import os
+import re
+import csv
+import threading
+import atexit
+import shutil
+import signal
+import tempfile
 
 # Config
 cookies_file = "drive.google.com_cookies.txt"
 captured_urls = []
+captured_set = set()  # URL đã clean (bỏ &range=) đã bắt được, tránh trùng
+PART_BUFFER_SIZE = 4 * 1024 * 1024  # buffer đọc/ghi của mỗi thread tải (đọc lớn → ít vòng lặp Python giữ GIL)
+IN_FLIGHT = 16  # số request Range chạy cùng lúc (cửa sổ trượt)
+MIN_PART_SIZE = 16 * 1024 * 1024  # kích thước tối thiểu mỗi phần khi chia file
+REDIRECT_PAGE_LIMIT = 64 * 1024  # đọc tối đa chừng này byte của trang trung gian để tìm URL
+SCRATCH_PREFIX = 'gdrive_'  # thư mục tạm trên RAM disk: gdrive_<pid>_xxxx
+_tls = threading.local()  # Session riêng cho mỗi thread tải
+FFMPEG_PATHS = [
+    r'C:\Users\phamt\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0.1-full_build\bin\ffmpeg.exe',
+]
+_ffmpeg_cmd = None  # cache kết quả find_ffmpeg()
+_PARAM_RE = re.compile(r'[?&](mime|itag|range|driveid)=([^&]+)')
+_PLAYBACK_RE = {
+    kind: re.compile(r'(https://[^\s"\'<>]+videoplayback[^\s"\'<>]+mime=' + kind + r'[^\s"\'<>]*)')
+    for kind in ('video', 'audio')
+}
 
 def clean_url(url):
     """Cắt URL từ &range= đến hết"""
-    if "&range=" in url:
-        return url.split("&range=")[0]
-    return url
+    return url.partition("&range=")[0]
+
+def parse_params(url):
+    """Lấy mime/itag/range/driveid từ URL trong 1 lần quét"""
+    return dict(_PARAM_RE.findall(url))
 
 def parse_netscape_cookies(cookie_file):
-    cookies = []
-    with open(cookie_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            parts = line.split('\t')
-            if len(parts) >= 7:
-                cookie = {
-                    'name': parts[5],
-                    'value': parts[6],
-                    'domain': parts[0],
-                    'path': parts[2],
-                    'secure': parts[3].upper() == 'TRUE',
-                }
-                if parts[4] != '0':
-                    try:
-                        cookie['expires'] = int(parts[4])
-                    except:
-                        pass
-                cookies.append(cookie)
-    return cookies
+    # csv.reader (viết bằng C) tách tab cho cả file trong 1 lượt
+    with open(cookie_file, 'r', encoding='utf-8', newline='') as f:
+        rows = [r for r in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+                if len(r) >= 7 and not r[0].lstrip().startswith('#')]
+    return [
+        {
+            'name': r[5],
+            'value': r[6].rstrip(),
+            'domain': r[0].lstrip(),
+            'path': r[2],
+            'secure': r[3].upper() == 'TRUE',
+            **({'expires': int(r[4])} if r[4] != '0' and r[4].isdigit() else {}),
+        }
+        for r in rows
+    ]
 
-def check_url_size(url, cookies_dict, headers):
-    """Kiểm tra size của URL, trả về 0 nếu là redirect page"""
+def size_or_zero(path):
+    """Size của file, 0 nếu không tồn tại (1 lần stat thay vì exists + getsize)"""
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+def remove_if_exists(path):
+    """Xóa file, trả về True nếu đã xóa"""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def make_session(cookies, headers, pool_size=128):
+    """Session dùng chung (cookies + headers gắn sẵn), giữ kết nối TCP/TLS giữa các request.
+    cookies: list cookie của Playwright (dict) hoặc CookieJar của session khác.
+    pool_size phải >= số thread tải song song, nếu không urllib3 sẽ bỏ bớt kết nối."""
     import requests
+    from requests.adapters import HTTPAdapter
+    from requests.cookies import create_cookie
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Dựng cookie jar 1 lần, giữ domain/path để chỉ gửi cookie cho đúng host
+    for c in cookies:
+        if isinstance(c, dict):
+            c = create_cookie(name=c['name'], value=c['value'], domain=c.get('domain', ''),
+                              path=c.get('path', '/'), secure=c.get('secure', False))
+        session.cookies.set_cookie(c)
+    session.headers.update(headers)
+    return session
+
+def worker_session(session):
+    """Session riêng của thread hiện tại (copy cookies + headers từ session chung),
+    tránh các thread tải tranh nhau lock của connection pool dùng chung"""
+    own = getattr(_tls, 'session', None)
+    if own is None:
+        own = _tls.session = make_session(session.cookies, session.headers, pool_size=2)
+    return own
+
+def check_url_size(session, url):
+    """Kiểm tra size của URL, trả về 0 nếu là redirect page"""
     try:
-        response = requests.head(url, cookies=cookies_dict, headers=headers, timeout=10, allow_redirects=True)
+        response = session.head(url, timeout=10, allow_redirects=True)
         content_length = int(response.headers.get('content-length', 0))
         return content_length
     except:
         return -1
 
-def download_part(url, start, end, part_file, cookies_dict, headers, part_num, progress_dict):
-    """Tải 1 phần của file"""
-    import requests
-    request_headers = headers.copy()
-    request_headers['Range'] = f'bytes={start}-{end}'
-    
+def probe_sizes(urls, session):
+    """HEAD song song tất cả URLs, trả về {url: size}"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    if not urls:
+        return {}
+    sizes = {}
+    with ThreadPoolExecutor(max_workers=min(32, len(urls))) as executor:
+        futures = {executor.submit(check_url_size, session, url): url for url in urls}
+        for future in as_completed(futures):
+            sizes[futures[future]] = future.result()
+    return sizes
+
+def download_part(session, url, start, end, range_hdr, filename, part_num, progress_q):
+    """Tải 1 phần của file, ghi thẳng vào đúng vị trí [start, end] trong file đích.
+    Trả về True chỉ khi tải đủ end - start + 1 byte, 'throttled' nếu server báo 429/503"""
+    session = worker_session(session)
     try:
-        response = requests.get(url, cookies=cookies_dict, headers=request_headers, stream=True, timeout=120)
-        if response.status_code in [200, 206]:
+        response = session.get(url, headers={'Range': range_hdr}, stream=True, timeout=120)
+        with response:
+            if response.status_code in (429, 503):
+                return 'throttled'
+            # Phần không bắt đầu từ 0 bắt buộc 206: 200 = server bỏ qua Range, trả dữ liệu từ đầu file
+            if response.status_code != 206 and not (response.status_code == 200 and start == 0):
+                print(f"[ERROR] Part {part_num}: HTTP {response.status_code}")
+                return False
             downloaded = 0
             total = end - start + 1
-            with open(part_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024*1024):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        progress_dict[part_num] = downloaded
+            # Đọc thẳng từ socket vào 1 buffer dùng lại (không tạo bytes mới mỗi chunk,
+            # GIL được nhả trong lúc recv/write)
+            buf = bytearray(min(PART_BUFFER_SIZE, total))
+            view = memoryview(buf)
+            # Mỗi thread mở handle riêng và seek 1 lần tới đoạn của mình, sau đó ghi tuần tự
+            # (các đoạn không chồng nhau nên không cần lock, chạy được cả trên Windows)
+            with open(filename, 'r+b', buffering=0) as f:
+                f.seek(start)
+                while downloaded < total:
+                    # Không đọc tràn sang phần của thread khác
+                    n = response.raw.readinto(view[:total - downloaded])
+                    if not n:
+                        break
+                    chunk = view[:n]
+                    while chunk:
+                        chunk = chunk[f.write(chunk):]
+                    downloaded += n
+                    progress_q.put(n)
+            if downloaded != total:
+                print(f"[ERROR] Part {part_num}: thiếu dữ liệu ({downloaded}/{total} bytes)")
+                return False
             return True
     except Exception as e:
         print(f"[ERROR] Part {part_num}: {str(e)[:50]}")
     return False
 
-def download_file_multithread(url, filename, cookies_dict, headers, num_threads=64):
-    """Tải file bằng multi-thread. Trả về 'redirect' nếu size < 10KB"""
-    import requests
-    from concurrent.futures import ThreadPoolExecutor, as_completed
-    import threading
+def download_file_multithread(session, url, filename, num_threads=64, in_flight=IN_FLIGHT, known_size=None):
+    """Tải file bằng multi-thread (num_threads phần, tối đa in_flight phần chạy cùng lúc).
+    known_size: size đã biết từ trước (bỏ qua HEAD). Trả về 'redirect' nếu size < 10KB"""
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    from queue import SimpleQueue
     
     # Xóa file lỗi nhỏ từ lần chạy trước
-    if os.path.exists(filename):
-        file_size = os.path.getsize(filename)
-        if file_size < 10000:
-            os.remove(filename)
-            print(f"[INFO] Deleted corrupted file: {filename}")
+    if size_or_zero(filename) < 10000 and remove_if_exists(filename):
+        print(f"[INFO] Deleted corrupted file: {filename}")
     
-    # Kiểm tra total size
-    try:
-        response = requests.head(url, cookies=cookies_dict, headers=headers, timeout=10)
-        total_size = int(response.headers.get('content-length', 0))
-    except:
-        total_size = 0
+    # Kiểm tra total size (nếu caller chưa biết)
+    if known_size is not None:
+        total_size = known_size
+    else:
+        try:
+            response = session.head(url, timeout=10)
+            total_size = int(response.headers.get('content-length', 0))
+        except:
+            total_size = 0
     
     if total_size < 10000:
         print(f"[WARNING] Size = {total_size} bytes (< 10KB), đây là redirect page...")
         return 'redirect'
     
-    print(f"[INFO] Total size: {total_size // 1024 // 1024}MB - Using {num_threads} threads")
+    # Mỗi phần ít nhất MIN_PART_SIZE, file nhỏ không chia quá vụn (TLS handshake lấn át thời gian tải)
+    num_threads = max(4, min(num_threads, total_size // MIN_PART_SIZE))
+    print(f"[INFO] Total size: {total_size // 1024 // 1024}MB - {num_threads} parts, {in_flight} in flight")
     
     # Chia file thành các phần
     part_size = total_size // num_threads
@@ -118,172 +212,142 @@ def download_file_multithread(url, filename, cookies_dict, headers, num_threads=
     for i in range(num_threads):
         start = i * part_size
         end = (i + 1) * part_size - 1 if i < num_threads - 1 else total_size - 1
-        part_file = f"{filename}.part{i}"
-        parts.append((start, end, part_file, i))
+        parts.append((start, end, i, f'bytes={start}-{end}'))
     
-    # Progress tracking
-    progress_dict = {i: 0 for i in range(num_threads)}
+    # Cấp sẵn file đủ kích thước, mỗi thread ghi vào đúng đoạn của mình (không cần gộp part)
+    with open(filename, 'wb') as f:
+        f.truncate(total_size)
+    
+    # Progress tracking: các thread tải đẩy số byte vào queue, thread này cộng dồn
+    progress_q = SimpleQueue()
+    done_bytes = [0]
     
     def print_progress():
-        while not download_done.is_set():
-            total_downloaded = sum(progress_dict.values())
-            percent = (total_downloaded / total_size) * 100 if total_size > 0 else 0
-            print(f"\r  Đang tải: {percent:.1f}% ({total_downloaded//1024//1024}MB/{total_size//1024//1024}MB)", end="", flush=True)
-            time.sleep(0.5)
+        last_percent = -1
+        while True:
+            n = progress_q.get()
+            if n is None:  # Tải xong
+                break
+            done_bytes[0] += n
+            # Chỉ in khi % (số nguyên) thay đổi
+            percent = done_bytes[0] * 100 // total_size
+            if percent != last_percent:
+                last_percent = percent
+                print(f"\r  Đang tải: {percent}% ({done_bytes[0]//1024//1024}MB/{total_size//1024//1024}MB)", end="", flush=True)
     
-    download_done = threading.Event()
     progress_thread = threading.Thread(target=print_progress)
     progress_thread.start()
     
-    # Download các phần song song
+    # Download các phần song song theo cửa sổ trượt: xong 1 phần mới gửi phần tiếp theo
     success = True
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = {
-            executor.submit(download_part, url, start, end, part_file, cookies_dict, headers, part_num, progress_dict): part_num
-            for start, end, part_file, part_num in parts
-        }
-        for future in as_completed(futures):
-            if not future.result():
-                success = False
+    queue = deque(parts)
+    window = min(in_flight, num_threads)
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            while queue or pending:
+                while queue and len(pending) < window:
+                    part = queue.popleft()
+                    start, end, part_num, range_hdr = part
+                    pending[executor.submit(download_part, session, url, start, end, range_hdr, filename, part_num, progress_q)] = part
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    part = pending.pop(future)
+                    result = future.result()
+                    if result == 'throttled' and window > 1:
+                        # Server đang giới hạn → giảm số request song song, tải lại phần này sau
+                        window = max(1, window // 2)
+                        queue.append(part)
+                        print(f"\n[WARNING] Part {part[2]} bị giới hạn (429/503), giảm còn {window} in flight")
+                    elif result is not True:
+                        success = False
+                        queue.clear()  # Không gửi thêm phần mới khi đã lỗi
+    finally:
+        progress_q.put(None)
+        progress_thread.join()
     
-    download_done.set()
-    progress_thread.join()
+    # File đã được cấp sẵn đủ size → kiểm tra số byte thực sự tải được
+    # (không cho sai số: đoạn thiếu sẽ là vùng byte 0 nằm giữa file)
+    downloaded = done_bytes[0]
+    if success and downloaded != total_size:
+        print(f"\n[WARNING] File size mismatch: {downloaded} vs {total_size}")
+        success = False
     
     if not success:
         print(f"\n[ERROR] Multi-thread download failed!")
-        # Cleanup
-        for _, _, part_file, _ in parts:
-            if os.path.exists(part_file):
-                os.remove(part_file)
+        # Cleanup (file cấp sẵn còn các đoạn trống)
+        remove_if_exists(filename)
         return False
     
-    # Gộp các phần lại
-    print(f"\n[INFO] Merging {num_threads} parts...")
-    with open(filename, 'wb') as outfile:
-        for _, _, part_file, _ in parts:
-            if os.path.exists(part_file):
-                with open(part_file, 'rb') as infile:
-                    outfile.write(infile.read())
-    
-    # Xóa part files riêng (tránh PermissionError trên Windows)
-    time.sleep(0.5)  # Đợi Windows release file handles
-    for _, _, part_file, _ in parts:
-        for retry in range(3):
-            try:
-                if os.path.exists(part_file):
-                    os.remove(part_file)
-                break
-            except PermissionError:
-                time.sleep(0.3)
-                continue
-    
-    # Verify final size
-    final_size = os.path.getsize(filename) if os.path.exists(filename) else 0
-    if final_size < total_size * 0.95:  # Cho phép sai số 5%
-        print(f"[WARNING] File size mismatch: {final_size} vs {total_size}")
+    print(f"\n✅ Đã tải: {filename} ({downloaded//1024//1024}MB)")
+    return True
+
+def pid_alive(pid):
+    """Process pid còn chạy không"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
         return False
-    
-    print(f"✅ Đã tải: {filename} ({final_size//1024//1024}MB)")
+    except OSError:
+        pass  # PermissionError: process tồn tại nhưng của user khác
     return True
 
-def download_file(url, filename, cookies_dict, headers, max_retries=3):
-    """Tải file từ URL với cookies và retry logic. Trả về 'redirect' nếu size = 0"""
-    import requests
-    
-    # Xóa file lỗi nhỏ (< 10KB) từ lần chạy trước
-    if os.path.exists(filename):
-        file_size = os.path.getsize(filename)
-        if file_size < 10000:  # < 10KB chắc chắn là lỗi
-            os.remove(filename)
-            print(f"[INFO] Deleted corrupted file: {filename} ({file_size} bytes)")
-    
-    for attempt in range(max_retries):
-        try:
-            # Check if file partially downloaded
-            downloaded = 0
-            mode = 'wb'
-            request_headers = headers.copy()
-            
-            if os.path.exists(filename):
-                downloaded = os.path.getsize(filename)
-                if downloaded > 0:
-                    request_headers['Range'] = f'bytes={downloaded}-'
-                    mode = 'ab'
-                    print(f"[INFO] Resuming from {downloaded//1024//1024}MB...")
-            
-            print(f"[INFO] Downloading {filename}... (attempt {attempt + 1}/{max_retries})")
-            response = requests.get(url, cookies=cookies_dict, headers=request_headers, stream=True, timeout=60)
-            
-            # Handle range response
-            if response.status_code == 206:
-                content_range = response.headers.get('content-range', '')
-                if '/' in content_range:
-                    total_size = int(content_range.split('/')[-1])
-                else:
-                    total_size = downloaded + int(response.headers.get('content-length', 0))
-            else:
-                total_size = int(response.headers.get('content-length', 0))
-                downloaded = 0
-                mode = 'wb'
-            
-            # Nếu size = 0 hoặc quá nhỏ (< 10KB), đây là redirect page
-            if total_size < 10000:
-                print(f"[WARNING] Size = {total_size} bytes (< 10KB), đây là redirect page...")
-                return 'redirect'
-            
-            if response.status_code in [200, 206] and total_size > 0:
-                with open(filename, mode) as f:
-                    for chunk in response.iter_content(chunk_size=1024*1024):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            percent = (downloaded / total_size) * 100
-                            print(f"\r  Đang tải: {percent:.1f}% ({downloaded//1024//1024}MB/{total_size//1024//1024}MB)", end="", flush=True)
-                
-                # Kiểm tra lại file size sau khi tải
-                actual_size = os.path.getsize(filename) if os.path.exists(filename) else 0
-                if actual_size < 10000:
-                    print(f"\n[WARNING] Downloaded file too small ({actual_size} bytes), likely redirect...")
-                    os.remove(filename)
-                    return 'redirect'
-                
-                print(f"\n✅ Đã tải: {filename} ({total_size//1024//1024}MB)")
-                return True
-            else:
-                print(f"[ERROR] Response status: {response.status_code}, size: {total_size}")
-                
-        except Exception as e:
-            print(f"\n[WARNING] Download error (attempt {attempt + 1}): {str(e)[:100]}")
-            if attempt < max_retries - 1:
-                print(f"[INFO] Retrying in 3 seconds...")
-                import time
-                time.sleep(3)
-            else:
-                print(f"[ERROR] Failed after {max_retries} attempts")
-                return False
-    
-    return False
+def cleanup_stale_scratch(root):
+    """Xóa thư mục tạm gdrive_<pid>_* của các process đã chết (bị kill trước khi kịp dọn),
+    nếu không file dở trên RAM disk chiếm RAM tới khi reboot"""
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    for entry in entries:
+        if not entry.name.startswith(SCRATCH_PREFIX) or not entry.is_dir(follow_symlinks=False):
+            continue
+        pid = entry.name[len(SCRATCH_PREFIX):].partition('_')[0]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            print(f"[INFO] Xóa thư mục tạm cũ: {entry.path}")
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def scratch_dir(needed_bytes):
+    """Thư mục chứa file video/audio tạm: thư mục riêng trên RAM disk (/dev/shm) nếu có và đủ chỗ,
+    để bước gộp FFmpeg chỉ đọc từ RAM. Ngược lại dùng thư mục hiện tại ('').
+    Thư mục RAM disk bị xóa khi thoát, kể cả khi bị dừng bằng SIGTERM"""
+    shm = '/dev/shm'
+    if not os.path.isdir(shm):
+        return ''
+    cleanup_stale_scratch(shm)
+    try:
+        # Chừa 10% để không làm đầy RAM
+        if shutil.disk_usage(shm).free <= needed_bytes * 1.1:
+            return ''
+        path = tempfile.mkdtemp(prefix=f"{SCRATCH_PREFIX}{os.getpid()}_", dir=shm)
+    except OSError:
+        return ''
+
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+
+    def on_sigterm(signum, frame):
+        # Thoát ngay (không chờ các thread tải đang chạy), dọn RAM disk trước
+        shutil.rmtree(path, ignore_errors=True)
+        os._exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    return path
+
+def find_ffmpeg():
+    """Tìm FFmpeg 1 lần (PATH trước, rồi các đường dẫn đã biết), cache kết quả.
+    Chỉ kiểm tra file tồn tại, không chạy `ffmpeg -version`"""
+    global _ffmpeg_cmd
+    if _ffmpeg_cmd is None:
+        _ffmpeg_cmd = shutil.which('ffmpeg') or next((p for p in FFMPEG_PATHS if os.path.exists(p)), '')
+        if _ffmpeg_cmd:
+            print(f"[INFO] Found FFmpeg: {_ffmpeg_cmd[:50]}...")
+    return _ffmpeg_cmd
 
 def merge_video_audio(video_file, audio_file, output_file):
     """Gộp video và audio bằng FFmpeg"""
     print(f"\n[STEP 10] Đang gộp video + audio...")
     
-    # Kiểm tra FFmpeg - thử nhiều đường dẫn
-    ffmpeg_paths = [
-        'ffmpeg',
-        r'C:\Users\phamt\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0.1-full_build\bin\ffmpeg.exe',
-    ]
-    
-    ffmpeg_cmd = None
-    for path in ffmpeg_paths:
-        try:
-            subprocess.run([path, '-version'], capture_output=True, check=True)
-            ffmpeg_cmd = path
-            print(f"[INFO] Found FFmpeg: {path[:50]}...")
-            break
-        except:
-            continue
-    
+    ffmpeg_cmd = find_ffmpeg()
     if not ffmpeg_cmd:
         print("[ERROR] FFmpeg chưa được cài đặt!")
         print("[INFO] Cài FFmpeg: https://ffmpeg.org/download.html")
@@ -292,7 +356,7 @@ def merge_video_audio(video_file, audio_file, output_file):
     
     # Gộp video + audio
     cmd = [
-        ffmpeg_cmd, '-y',
+        ffmpeg_cmd, '-y', '-hide_banner', '-loglevel', 'warning',
         '-i', video_file,
         '-i', audio_file,
         '-c', 'copy',
@@ -315,6 +379,49 @@ def merge_video_audio(video_file, audio_file, output_file):
         print(f"[ERROR] Merge error: {e}")
         return False
 
+def resolve_stream_url(session, url, kind, step, max_redirects=5):
+    """Theo redirect của URL video/audio (kind) bằng HTTP tới khi URL trả về size thật (>= 10KB).
+    Trả về (URL cuối cùng, size), hoặc (None, 0) nếu không tìm được"""
+    current_url = url
+    for redirect_count in range(max_redirects):
+        print(f"\n[STEP {step}] Mở URL {kind}... (attempt {redirect_count + 1}/{max_redirects})")
+        try:
+            # requests tự theo 302, không cần mở Chromium + đợi 3s
+            response = session.get(current_url, allow_redirects=True, stream=True, timeout=15)
+        except Exception as e:
+            print(f"[ERROR] Request error: {str(e)[:100]}")
+            break
+        
+        with response:
+            size = int(response.headers.get('content-length', 0))
+            if response.status_code in (200, 206) and size >= 10000:
+                if response.url != current_url:
+                    print(f"[INFO] Followed HTTP redirect")
+                return clean_url(response.url), size
+            print(f"[WARNING] Size = {size} bytes (< 10KB), đây là redirect page...")
+
+            # Chỉ trang HTML mới chứa URL để theo; stream video/audio không có
+            # content-length (chunked) thì không đọc body vào RAM
+            if 'text/html' not in response.headers.get('content-type', ''):
+                print(f"[ERROR] No redirect URL found!")
+                break
+            # Trang trung gian nhỏ → tìm URL videoplayback trong tối đa REDIRECT_PAGE_LIMIT byte đầu
+            page = response.raw.read(REDIRECT_PAGE_LIMIT, decode_content=True)
+            matches = _PLAYBACK_RE[kind].findall(page.decode(response.encoding or 'utf-8', 'replace'))
+
+        if matches:
+            # Decode HTML entities
+            new_url = matches[0].replace('\\u0026', '&').replace('&amp;', '&')
+            if clean_url(new_url) != current_url:
+                current_url = clean_url(new_url)
+                print(f"[DEBUG] HTML URL: {current_url[:100]}...")
+                print(f"[INFO] Found URL in page content, following...")
+                continue
+        
+        print(f"[ERROR] No redirect URL found!")
+        break
+    return None, 0
+
 def main():
     global captured_urls
     
@@ -356,14 +463,24 @@ def main():
         
         page = context.new_page()
         
-        # Bắt network requests
+        captured_types = set()
+        capture_ready = threading.Event()  # set khi đã có ít nhất 1 video + 1 audio
+        
+        # Bắt network requests (mỗi asset chỉ giữ 1 URL, bỏ qua các request range khác nhau)
         def handle_response(response):
             url = response.url
-            if "&mime=video" in url or "&mime=audio" in url:
-                mime_type = "video" if "&mime=video" in url else "audio"
-                if not any(u['url'] == url for u in captured_urls):
-                    captured_urls.append({"type": mime_type, "url": url})
-                    print(f"[CAPTURED] {mime_type}!", flush=True)
+            mime = parse_params(url).get('mime', '')
+            if mime.startswith(('video', 'audio')):
+                key = clean_url(url)
+                if key in captured_set:
+                    return
+                captured_set.add(key)
+                mime_type = "video" if mime.startswith('video') else "audio"
+                captured_urls.append({"type": mime_type, "url": key})
+                print(f"[CAPTURED] {mime_type}!", flush=True)
+                captured_types.add(mime_type)
+                if len(captured_types) == 2:
+                    capture_ready.set()
         
         page.on("response", handle_response)
         print("[STEP 1] Network listener ready")
@@ -428,15 +545,16 @@ def main():
         # ===== STEP 4: Đợi capture URLs =====
         print("\n[STEP 4] Video đang chạy, đang capture URLs...")
         
-        for i in range(30):
-            page.wait_for_timeout(1000)
-            video_count = sum(1 for u in captured_urls if u['type'] == 'video')
-            audio_count = sum(1 for u in captured_urls if u['type'] == 'audio')
-            print(f"  Đã đợi {i+1}s - Captured: {video_count} video, {audio_count} audio URLs", flush=True)
-            # Đợi ít nhất có 1 video + 1 audio, và đợi ít nhất 10s để bắt thêm URLs chất lượng cao
-            if video_count >= 1 and audio_count >= 1 and i >= 10:
-                page.wait_for_timeout(5000)
-                break
+        # Warmup tối thiểu để player chuyển sang itag chất lượng cao
+        page.wait_for_timeout(5000)
+        # Đợi tới khi có đủ 1 video + 1 audio (tối đa 25s). Sync API chỉ gọi handle_response
+        # khi đang ở trong lệnh Playwright → đợi bằng các nhịp wait_for_timeout ngắn
+        deadline = time.monotonic() + 25
+        while not capture_ready.is_set() and time.monotonic() < deadline:
+            page.wait_for_timeout(250)
+        if capture_ready.is_set():
+            print("  ✅ Đã bắt được video + audio, đợi thêm để bắt URLs chất lượng cao...", flush=True)
+            page.wait_for_timeout(3000)
         
         video_count = sum(1 for u in captured_urls if u['type'] == 'video')
         audio_count = sum(1 for u in captured_urls if u['type'] == 'audio')
@@ -447,19 +565,22 @@ def main():
         
         # Lấy cookies từ browser để check size
         browser_cookies = context.cookies()
-        cookies_dict = {c['name']: c['value'] for c in browser_cookies}
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Referer': 'https://drive.google.com/'
         }
         
         # Thu thập tất cả video URLs (đã clean)
-        all_video_urls = list(set([clean_url(u['url']) for u in captured_urls if u['type'] == 'video']))
-        all_audio_urls = list(set([clean_url(u['url']) for u in captured_urls if u['type'] == 'audio']))
+        all_video_urls = [u['url'] for u in captured_urls if u['type'] == 'video']
+        all_audio_urls = [u['url'] for u in captured_urls if u['type'] == 'audio']
         
         print(f"  Tìm thấy {len(all_video_urls)} video URL(s) khác nhau")
         print(f"  Tìm thấy {len(all_audio_urls)} audio URL(s) khác nhau")
         
+        # 1 session cho cả STEP 5 → 9: HEAD + tải đều dùng lại kết nối
+        session = make_session(browser_cookies, headers)
+        sizes = probe_sizes(all_video_urls + all_audio_urls, session)
+        
         # Kiểm tra size từng video URL để chọn chất lượng cao nhất
         video_url = None
         best_video_size = 0
@@ -467,16 +588,12 @@ def main():
         if all_video_urls:
             print(f"\n  📊 Kiểm tra kích thước từng video URL:")
             for i, vurl in enumerate(all_video_urls):
-                size = check_url_size(vurl, cookies_dict, headers)
+                size = sizes[vurl]
                 size_mb = size / 1024 / 1024 if size > 0 else 0
                 # Parse itag nếu có
-                itag = ''
-                if 'itag=' in vurl:
-                    try:
-                        itag = vurl.split('itag=')[1].split('&')[0]
-                        itag = f' (itag={itag})'
-                    except:
-                        pass
+                itag = parse_params(vurl).get('itag', '')
+                if itag:
+                    itag = f' (itag={itag})'
                 print(f"    Video #{i+1}{itag}: {size_mb:.1f}MB ({size} bytes)")
                 if size > best_video_size:
                     best_video_size = size
@@ -492,15 +609,11 @@ def main():
         if all_audio_urls:
             print(f"\n  📊 Kiểm tra kích thước từng audio URL:")
             for i, aurl in enumerate(all_audio_urls):
-                size = check_url_size(aurl, cookies_dict, headers)
+                size = sizes[aurl]
                 size_mb = size / 1024 / 1024 if size > 0 else 0
-                itag = ''
-                if 'itag=' in aurl:
-                    try:
-                        itag = aurl.split('itag=')[1].split('&')[0]
-                        itag = f' (itag={itag})'
-                    except:
-                        pass
+                itag = parse_params(aurl).get('itag', '')
+                if itag:
+                    itag = f' (itag={itag})'
                 print(f"    Audio #{i+1}{itag}: {size_mb:.1f}MB ({size} bytes)")
                 if size > best_audio_size:
                     best_audio_size = size
@@ -514,157 +627,60 @@ def main():
         else:
             print(f"⚠️ Chỉ lấy được: video={'có' if video_url else 'không'}, audio={'có' if audio_url else 'không'}")
         
-        # cookies_dict và headers đã được lấy ở STEP 5
+        # cookies và headers đã được gắn vào session ở STEP 5
         
         # Lấy file ID
-        import re
-        driveid_match = re.search(r'driveid=([^&]+)', video_url or audio_url or "")
-        file_id = driveid_match.group(1)[:8] if driveid_match else "download"
+        driveid = parse_params(video_url or audio_url or "").get('driveid')
+        file_id = driveid[:8] if driveid else "download"
         
-        video_file = f"video_{file_id}.mp4"
-        audio_file = f"audio_{file_id}.m4a"
+        tmp_dir = scratch_dir(best_video_size + best_audio_size)
+        if tmp_dir:
+            print(f"[INFO] File tạm lưu trên RAM disk: {tmp_dir}")
+        video_file = os.path.join(tmp_dir, f"video_{file_id}.mp4")
+        audio_file = os.path.join(tmp_dir, f"audio_{file_id}.m4a")
         output_merged = f"merged_{file_id}.mp4"
         
-        # ===== STEP 6 & 7: Mở và tải video =====
+        # ===== STEP 6 & 8: Theo redirect bằng HTTP (không cần page) =====
+        # size lấy luôn từ response cuối → STEP 7/9 không cần HEAD lại
         if video_url:
-            current_url = video_url
-            max_redirects = 5
-            for redirect_count in range(max_redirects):
-                print(f"\n[STEP 6] Mở URL video... (attempt {redirect_count + 1}/{max_redirects})")
-                
-                # Clear captured URLs để capture URL mới
-                redirect_urls = []
-                def capture_redirect(response):
-                    url = response.url
-                    if "&mime=video" in url and url != current_url:
-                        if url not in redirect_urls:
-                            redirect_urls.append(url)
-                            print(f"[CAPTURED] New video URL!")
-                
-                page.on("response", capture_redirect)
-                page.goto(current_url)
-                page.wait_for_timeout(3000)
-                page.remove_listener("response", capture_redirect)
-                
-                print(f"\n[STEP 7] Tải video (multi-thread)...")
-                result = download_file_multithread(current_url, video_file, cookies_dict, headers)
-                
-                if result == 'redirect':
-                    # Tìm URL mới từ captured hoặc từ page
-                    if redirect_urls:
-                        current_url = clean_url(redirect_urls[0])
-                        print(f"[DEBUG] Network URL: {current_url[:100]}...")
-                        print(f"[INFO] Found new URL from network, following redirect...")
-                        continue
-                    else:
-                        # Thử lấy từ page URL
-                        page_url = page.url
-                        if "videoplayback" in page_url and page_url != current_url:
-                            current_url = clean_url(page_url)
-                            print(f"[DEBUG] Page URL: {current_url[:100]}...")
-                            print(f"[INFO] Using page URL as redirect...")
-                            continue
-                        
-                        # Thử parse URL từ content của page
-                        try:
-                            content = page.content()
-                            import re
-                            # Tìm URL videoplayback trong HTML
-                            matches = re.findall(r'(https://[^\s"\'<>]+videoplayback[^\s"\'<>]+mime=video[^\s"\'<>]*)', content)
-                            if matches:
-                                # Decode HTML entities
-                                new_url = matches[0].replace('\\u0026', '&').replace('&amp;', '&')
-                                current_url = clean_url(new_url)
-                                print(f"[DEBUG] HTML URL: {current_url[:100]}...")
-                                print(f"[INFO] Found URL in page content, following...")
-                                continue
-                        except Exception as e:
-                            print(f"[DEBUG] Parse content error: {e}")
-                    
-                    print(f"[ERROR] No redirect URL found!")
-                    break
-                elif result == True:
-                    print(f"[INFO] Video downloaded successfully!")
-                    break
-                else:
-                    print(f"[ERROR] Video download failed!")
-                    break
-        
-        # ===== STEP 8 & 9: Mở và tải audio =====
+            video_url, best_video_size = resolve_stream_url(session, video_url, 'video', 6)
         if audio_url:
-            current_url = audio_url
-            max_redirects = 5
-            for redirect_count in range(max_redirects):
-                print(f"\n[STEP 8] Mở URL audio... (attempt {redirect_count + 1}/{max_redirects})")
-                
-                # Clear captured URLs để capture URL mới
-                redirect_urls = []
-                def capture_audio_redirect(response):
-                    url = response.url
-                    if "&mime=audio" in url and url != current_url:
-                        if url not in redirect_urls:
-                            redirect_urls.append(url)
-                            print(f"[CAPTURED] New audio URL!")
-                
-                page.on("response", capture_audio_redirect)
-                page.goto(current_url)
-                page.wait_for_timeout(3000)
-                page.remove_listener("response", capture_audio_redirect)
-                
-                print(f"\n[STEP 9] Tải audio (multi-thread)...")
-                result = download_file_multithread(current_url, audio_file, cookies_dict, headers)
-                
-                if result == 'redirect':
-                    # Tìm URL mới từ captured hoặc từ page
-                    if redirect_urls:
-                        current_url = clean_url(redirect_urls[0])
-                        print(f"[DEBUG] Network URL: {current_url[:100]}...")
-                        print(f"[INFO] Found new URL from network, following redirect...")
-                        continue
-                    else:
-                        # Thử lấy từ page URL
-                        page_url = page.url
-                        if "videoplayback" in page_url and page_url != current_url:
-                            current_url = clean_url(page_url)
-                            print(f"[DEBUG] Page URL: {current_url[:100]}...")
-                            print(f"[INFO] Using page URL as redirect...")
-                            continue
-                        
-                        # Thử parse URL từ content của page
-                        try:
-                            content = page.content()
-                            import re
-                            # Tìm URL videoplayback trong HTML
-                            matches = re.findall(r'(https://[^\s"\'<>]+videoplayback[^\s"\'<>]+mime=audio[^\s"\'<>]*)', content)
-                            if matches:
-                                # Decode HTML entities
-                                new_url = matches[0].replace('\\u0026', '&').replace('&amp;', '&')
-                                current_url = clean_url(new_url)
-                                print(f"[DEBUG] HTML URL: {current_url[:100]}...")
-                                print(f"[INFO] Found URL in page content, following...")
-                                continue
-                        except Exception as e:
-                            print(f"[DEBUG] Parse content error: {e}")
-                    
-                    print(f"[ERROR] No redirect URL found!")
-                    break
-                elif result == True:
-                    print(f"[INFO] Audio downloaded successfully!")
-                    break
+            audio_url, best_audio_size = resolve_stream_url(session, audio_url, 'audio', 8)
+        
+        # ===== STEP 7 & 9: Tải video + audio song song (2 luồng độc lập, mỗi file 32 parts) =====
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = [(u, f, size) for u, f, size in (
+            (video_url, video_file, best_video_size), (audio_url, audio_file, best_audio_size)) if u]
+        if jobs:
+            print(f"\n[STEP 7 & 9] Tải {len(jobs)} file song song (multi-thread)...")
+            with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+                results = list(executor.map(
+                    lambda job: download_file_multithread(session, job[0], job[1], num_threads=32, known_size=job[2]), jobs))
+            for (_, filename, _), result in zip(jobs, results):
+                if result == True:
+                    print(f"[INFO] Downloaded successfully: {filename}")
                 else:
-                    print(f"[ERROR] Audio download failed!")
-                    break
+                    print(f"[ERROR] Download failed: {filename}")
         
         print("\n[INFO] Đóng browser...")
         browser.close()
     
     # ===== STEP 10: Gộp video + audio =====
     if video_url and audio_url:
-        if os.path.exists(video_file) and os.path.exists(audio_file):
+        if size_or_zero(video_file) and size_or_zero(audio_file):
             merge_video_audio(video_file, audio_file, output_merged)
     
+    # Không gộp được → chuyển file tạm từ RAM disk về thư mục hiện tại để giữ lại
+    if tmp_dir:
+        for f in (video_file, audio_file):
+            try:
+                shutil.move(f, os.path.basename(f))
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    
     # Output file path for web server to pick up
-    if os.path.exists(output_merged):
+    if size_or_zero(output_merged):
         print(f"OUTPUT_FILE:{output_merged}")
     
     print("\n" + "=" * 60)
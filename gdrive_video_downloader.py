@@ -10,72 +10,310 @@ Yêu cầu:
     playwright install chromium
 """
 
+import os
 import re
+import csv
 import sys
 import time
+import atexit
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
+from typing import Iterator
+from urllib.parse import parse_qs, urlparse
 from playwright.sync_api import sync_playwright, Page, BrowserContext
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+GET_VIDEO_INFO_URL = 'https://drive.google.com/get_video_info'
+# /file/d/<id> (share link), id=<id> (direct download), /d/<id> (short link)
+_FILE_ID_RE = re.compile(r'(?:/file/d/|id=|/d/)([a-zA-Z0-9_-]+)')
+_ITAG_RE = re.compile(r'itag=(\d+)')
+BLOCKED_RESOURCE_TYPES = {'image', 'font', 'stylesheet', 'media'}  # không cần để player phát video
+BROWSER_POOL_SIZE = 4     # số context giữ sẵn tối đa trong pool
+CONTEXT_MAX_USES = 20     # context dùng quá số lần này sẽ bị đóng, tạo mới
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024   # 1 MiB / lần write
+PROGRESS_INTERVAL = 0.25            # in tiến độ tối đa 4 lần / giây
+PARALLEL_RANGES = 4                 # số request Range song song; 0/1 = tắt (tải 1 luồng)
+MIN_PARALLEL_SIZE = 8 * 1024 * 1024 # file nhỏ hơn thì tải 1 luồng
+BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+]
+
+
+def make_session() -> requests.Session:
+    """Session dùng chung: giữ kết nối keep-alive giữa các lần tải + tự retry lỗi tạm thời"""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_SESSION = make_session()
 
 
 def parse_netscape_cookies(cookie_file: str) -> list[dict]:
     """
     Parse cookies từ file Netscape format (dùng bởi yt-dlp, curl, etc.)
+    Kết quả được cache theo (đường dẫn, mtime) — file đổi thì parse lại.
+    Không được sửa list trả về.
     
     Format: domain  include_subdomains  path  secure  expiry  name  value
     """
-    cookies = []
+    return _parse_cookies_cached(cookie_file, os.path.getmtime(cookie_file))
+
+
+def google_cookies(cookie_file: str) -> list[dict]:
+    """Cookies *.google.com trong file (cache cùng key với parse_netscape_cookies). Không được sửa list trả về."""
+    return _google_cookies_cached(cookie_file, os.path.getmtime(cookie_file))
+
+
+@lru_cache(maxsize=4)
+def _google_cookies_cached(cookie_file: str, mtime: float) -> list[dict]:
+    cookies = _parse_cookies_cached(cookie_file, mtime)
+    return [c for c in cookies if 'google.com' in c['domain']]
+
+
+def set_session_cookies(cookies: list[dict]) -> None:
+    """
+    Thay cookies Google trong _SESSION bằng cookies có domain/path:
+    chỉ gửi tới đúng host, và bản cũ (kể cả do server set) bị xóa trước
+    nên không bị gửi trùng tên bên cạnh bản mới.
+    """
+    jar = _SESSION.cookies
+    for domain in {c.domain for c in jar if 'google.com' in c.domain}:
+        jar.clear(domain)
+    for c in cookies:
+        jar.set_cookie(create_cookie(
+            name=c['name'], value=c['value'], domain=c.get('domain', ''),
+            path=c.get('path', '/'), secure=c.get('secure', False),
+        ))
+
+
+@lru_cache(maxsize=4)
+def _parse_cookies_cached(cookie_file: str, mtime: float) -> list[dict]:
+    # csv.reader (viết bằng C) tách tab cho cả file; bỏ comment và dòng thiếu cột
+    with open(cookie_file, 'r', encoding='utf-8', newline='') as f:
+        rows = [r for r in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
+                if len(r) >= 7 and not r[0].lstrip().startswith('#')]
     
-    with open(cookie_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            
-            # Bỏ qua comment và dòng trống
-            if not line or line.startswith('#'):
-                continue
-            
-            parts = line.split('\t')
-            if len(parts) >= 7:
-                domain = parts[0]
-                # include_subdomains = parts[1].upper() == 'TRUE'
-                path = parts[2]
-                secure = parts[3].upper() == 'TRUE'
-                expiry = int(parts[4]) if parts[4].isdigit() else 0
-                name = parts[5]
-                value = parts[6]
-                
-                cookie = {
-                    'name': name,
-                    'value': value,
-                    'domain': domain,
-                    'path': path,
-                    'secure': secure,
-                }
-                
-                # Chỉ thêm expires nếu > 0
-                if expiry > 0:
-                    cookie['expires'] = expiry
-                
-                cookies.append(cookie)
+    cookies = []
+    for r in rows:
+        # Format: domain  include_subdomains  path  secure  expiry  name  value
+        cookie = {
+            'name': r[5],
+            'value': r[6].rstrip(),
+            'domain': r[0].lstrip(),
+            'path': r[2],
+            'secure': r[3].upper() == 'TRUE',
+        }
+        # Chỉ thêm expires nếu > 0
+        expiry = int(r[4]) if r[4].isdigit() else 0
+        if expiry > 0:
+            cookie['expires'] = expiry
+        cookies.append(cookie)
     
     return cookies
 
 
 def extract_file_id(url: str) -> str | None:
     """Trích xuất file ID từ Google Drive URL"""
-    patterns = [
-        r'/file/d/([a-zA-Z0-9_-]+)',  # Standard share link
-        r'id=([a-zA-Z0-9_-]+)',        # Direct download link
-        r'/d/([a-zA-Z0-9_-]+)',        # Short link
+    match = _FILE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+
+def fetch_video_info(file_id: str, cookies: list[dict]) -> list[dict]:
+    """
+    Lấy URL videoplayback trực tiếp từ API get_video_info (không cần mở browser)
+    
+    Args:
+        file_id: ID file trên Google Drive
+        cookies: Cookies Google (đã parse từ file Netscape)
+    
+    Returns:
+        List video info cùng dạng với capture_video_url, rỗng nếu API không trả về URL
+    """
+    set_session_cookies(cookies)
+    try:
+        response = _SESSION.get(
+            GET_VIDEO_INFO_URL,
+            params={'docid': file_id},
+            headers={'User-Agent': USER_AGENT, 'Referer': 'https://drive.google.com/'},
+            timeout=15
+        )
+    except requests.RequestException as e:
+        print(f"[WARNING] get_video_info lỗi: {e}")
+        return []
+    
+    if response.status_code != 200:
+        print(f"[WARNING] get_video_info trả về HTTP {response.status_code}")
+        return []
+    
+    data = parse_qs(response.text)
+    if data.get('status', [''])[0] != 'ok':
+        reason = data.get('reason', [''])[0]
+        print(f"[WARNING] get_video_info không thành công: {reason[:100]}")
+        return []
+    
+    # Cookie DRIVE_STREAM trả về cùng response là bắt buộc khi tải các URL này (giữ domain/path)
+    stream_cookies = [
+        {'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure}
+        for c in response.cookies
     ]
+    timestamp = datetime.now().isoformat()
+    
+    # fmt_stream_map: "itag|url,itag|url,..."
+    video_urls = []
+    for entry in data.get('fmt_stream_map', [''])[0].split(','):
+        itag, _, url = entry.partition('|')
+        if not url:
+            continue
+        video_urls.append({
+            'url': url,
+            'timestamp': timestamp,
+            'method': 'GET',
+            'type': 'audio' if 'mime=audio' in url else 'video',
+            'itag': itag,
+            'cookies': stream_cookies,
+        })
+    
+    return video_urls
+
+
+class BrowserPool:
+    """
+    Giữ browser Chromium + các context (đã thêm cookies) để dùng lại giữa các lần
+    capture, tránh mất 2-3s khởi động browser cho mỗi video.
+    
+    Playwright sync API gắn với thread đã khởi tạo nó → chỉ dùng pool trong 1 thread.
+    """
+    
+    def __init__(self, headless: bool = True, size: int = BROWSER_POOL_SIZE, max_uses: int = CONTEXT_MAX_USES):
+        self.headless = headless
+        self.size = size
+        self.max_uses = max_uses
+        self._playwright = None
+        self._browser = None
+        self._idle: dict[tuple, list] = {}  # cookie key -> [[context, số lần dùng], ...]
+        self._lock = threading.Lock()
+    
+    def _get_browser(self):
+        """Khởi động browser lần đầu, hoặc lại nếu browser đã bị ngắt"""
+        if self._browser is None or not self._browser.is_connected():
+            if self._playwright is None:
+                self._playwright = sync_playwright().start()
+            print(f"[INFO] Khởi động browser (headless={self.headless})...")
+            self._browser = self._playwright.chromium.launch(headless=self.headless, args=BROWSER_ARGS)
+            self._idle.clear()  # Context của browser cũ không dùng được nữa
+        return self._browser
     
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
+    @staticmethod
+    def _key(cookies: list[dict]) -> tuple:
+        return tuple(sorted((c['domain'], c['path'], c['name'], c['value']) for c in cookies))
     
-    return None
+    @contextmanager
+    def acquire(self, cookies: list[dict]) -> Iterator[BrowserContext]:
+        """Lấy 1 context đã có cookies (dùng lại nếu có sẵn), tự trả về pool khi xong"""
+        key = self._key(cookies)
+        with self._lock:
+            browser = self._get_browser()
+            idle = self._idle.get(key)
+            entry = idle.pop() if idle else None
+        
+        if entry is None:
+            context = browser.new_context(
+                viewport={'width': 1920, 'height': 1080},
+                user_agent=USER_AGENT
+            )
+            try:
+                context.add_cookies(cookies)
+                print("[INFO] Đã thêm cookies vào browser")
+            except Exception as e:
+                print(f"[WARNING] Lỗi khi thêm cookies: {e}")
+            entry = [context, 0]
+        else:
+            print("[INFO] Dùng lại browser context có sẵn")
+        
+        entry[1] += 1
+        ok = False
+        try:
+            yield entry[0]
+            ok = True
+        finally:
+            self._release(key, entry, ok)
+    
+    def _release(self, key: tuple, entry: list, ok: bool):
+        context, uses = entry
+        with self._lock:
+            idle_count = sum(len(v) for v in self._idle.values())
+            if ok and uses < self.max_uses and idle_count < self.size and self._browser.is_connected():
+                self._idle.setdefault(key, []).append(entry)
+                return
+        try:
+            context.close()
+        except Exception:
+            pass
+    
+    def close(self):
+        """Đóng browser và dừng Playwright"""
+        with self._lock:
+            self._idle.clear()
+            if self._browser is not None:
+                try:
+                    self._browser.close()
+                except Exception:
+                    pass
+            if self._playwright is not None:
+                self._playwright.stop()
+            self._browser = self._playwright = None
+
+
+_browser_pools: dict[bool, BrowserPool] = {}
+
+
+def get_browser_pool(headless: bool = True) -> BrowserPool:
+    """Pool dùng chung cho mỗi chế độ headless, tự đóng khi thoát chương trình"""
+    pool = _browser_pools.get(headless)
+    if pool is None:
+        if not _browser_pools:
+            atexit.register(close_browser_pools)
+        pool = _browser_pools[headless] = BrowserPool(headless=headless)
+    return pool
+
+
+def close_browser_pools():
+    for pool in _browser_pools.values():
+        pool.close()
+    _browser_pools.clear()
+
+
+def block_heavy_resources(route):
+    """Chặn ảnh/font/CSS/media (trừ videoplayback) để trang load nhanh hơn"""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES and 'videoplayback' not in request.url:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def wait_for_capture(page: Page, captured: threading.Event, timeout_ms: int):
+    """
+    Đợi tới khi captured được set hoặc hết timeout_ms.
+    Sync API chỉ gọi handler khi đang ở trong lệnh Playwright → đợi bằng các nhịp 200ms
+    """
+    deadline = time.monotonic() + timeout_ms / 1000
+    while not captured.is_set() and time.monotonic() < deadline:
+        page.wait_for_timeout(200)
 
 
 def capture_video_url(
@@ -85,7 +323,8 @@ def capture_video_url(
     wait_time: int = 15000
 ) -> list[dict]:
     """
-    Mở Google Drive video và bắt URL videoplayback từ network
+    Lấy URL videoplayback: thử API get_video_info trước, nếu không được
+    mới mở Google Drive video bằng browser và bắt URL từ network
     
     Args:
         google_drive_url: URL của video trên Google Drive
@@ -111,140 +350,137 @@ def capture_video_url(
     google_cookies = [c for c in cookies if 'google.com' in c['domain'] or 'drive.google.com' in c['domain']]
     print(f"[INFO] {len(google_cookies)} cookies liên quan đến Google")
     
-    with sync_playwright() as p:
-        # Khởi tạo browser
-        print(f"[INFO] Khởi động browser (headless={headless})...")
-        browser = p.chromium.launch(
-            headless=headless,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-            ]
-        )
-        
-        # Tạo context với cookies
-        context = browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        )
-        
-        # Thêm cookies vào context
-        try:
-            context.add_cookies(google_cookies)
-            print("[INFO] Đã thêm cookies vào browser")
-        except Exception as e:
-            print(f"[WARNING] Lỗi khi thêm cookies: {e}")
-        
+    # Thử API trước: 1 HTTP request thay vì khởi động Chromium + đợi player
+    file_id = extract_file_id(google_drive_url)
+    if file_id:
+        print(f"[INFO] Đang lấy URL qua get_video_info (docid={file_id})...")
+        video_urls = fetch_video_info(file_id, google_cookies)
+        if video_urls:
+            print(f"[INFO] Lấy được {len(video_urls)} URL(s) qua API, bỏ qua browser")
+            return video_urls
+        print("[INFO] API không trả về URL, chuyển sang Playwright...")
+    
+    # Browser + context lấy từ pool (đã khởi động sẵn từ lần capture trước)
+    with get_browser_pool(headless).acquire(google_cookies) as context:
         page = context.new_page()
+        page.route('**/*', block_heavy_resources)
+        captured = threading.Event()  # set khi đã bắt được URL video
+        seen = set()  # URL videoplayback đã bắt (tránh duplicate, O(1) mỗi request)
         
         # Handler để bắt network requests
         def handle_request(request):
             url = request.url
-            # Lọc URL videoplayback với đầy đủ params (như mẫu user cung cấp)
-            if 'videoplayback' in url and 'drive.google.com' in url:
-                # Kiểm tra có đủ params quan trọng
-                if 'expire=' in url and 'itag=' in url and 'source=' in url:
-                    video_info = {
-                        'url': url,
-                        'timestamp': datetime.now().isoformat(),
-                        'method': request.method,
-                    }
-                    
-                    # Xác định loại dựa trên itag hoặc mime
-                    if 'mime=video' in url:
-                        video_info['type'] = 'video'
-                    elif 'mime=audio' in url:
-                        video_info['type'] = 'audio'
-                    else:
-                        video_info['type'] = 'unknown'
-                    
-                    # Trích xuất itag
-                    import re
-                    itag_match = re.search(r'itag=(\d+)', url)
-                    if itag_match:
-                        video_info['itag'] = itag_match.group(1)
-                    
-                    # Tránh duplicate
-                    if not any(v['url'] == url for v in video_urls):
-                        video_urls.append(video_info)
-                        itag_str = f" (itag={video_info.get('itag', '?')})" if 'itag' in video_info else ""
-                        print(f"\n[CAPTURED] {video_info['type'].upper()}{itag_str}:")
-                        print(f"URL: {url}")
-        
+            # Lọc URL videoplayback với đầy đủ params (như mẫu user cung cấp).
+            # Các phép `in` dừng sớm ở URL không khớp — nhanh hơn 1 regex lookahead quét lại URL nhiều lần
+            if not ('videoplayback' in url and 'drive.google.com' in url
+                    and 'expire=' in url and 'itag=' in url and 'source=' in url):
+                return
+            if url in seen:
+                return
+            seen.add(url)
+
+            video_info = {
+                'url': url,
+                'timestamp': datetime.now().isoformat(),
+                'method': request.method,
+            }
+
+            # Xác định loại dựa trên mime
+            if 'mime=video' in url:
+                video_info['type'] = 'video'
+            elif 'mime=audio' in url:
+                video_info['type'] = 'audio'
+            else:
+                video_info['type'] = 'unknown'
+
+            # Trích xuất itag (lần xuất hiện đầu tiên, như trước)
+            itag_match = _ITAG_RE.search(url)
+            if itag_match:
+                video_info['itag'] = itag_match.group(1)
+            
+            video_urls.append(video_info)
+            itag_str = f" (itag={video_info.get('itag', '?')})" if 'itag' in video_info else ""
+            print(f"\n[CAPTURED] {video_info['type'].upper()}{itag_str}:")
+            print(f"URL: {url}")
+            if video_info['type'] == 'video':
+                captured.set()
+
         page.on('request', handle_request)
         
         # Mở trang Google Drive
         print(f"[INFO] Đang mở: {google_drive_url}")
         try:
-            page.goto(google_drive_url, wait_until='networkidle', timeout=30000)
+            # Không dùng networkidle: player giữ kết nối liên tục nên có thể không bao giờ idle
+            page.goto(google_drive_url, wait_until='domcontentloaded', timeout=15000)
         except Exception as e:
             print(f"[WARNING] Timeout khi load trang: {e}")
         
-        # Chờ trang load
+        # Chờ player load (dừng sớm nếu video tự phát và đã bắt được URL)
         print("[INFO] Đang đợi video player load...")
-        page.wait_for_timeout(5000)
-        
-        # Thử click vào video để play - nhiều phương pháp
-        print("[INFO] Đang thử click play...")
-        clicked = False
-        
-        # Phương pháp 1: Click vào giữa màn hình (vị trí nút play)
-        try:
-            page.mouse.click(640, 390)  # Click vào giữa video
-            print("[INFO] Đã click vào giữa video")
-            clicked = True
-            page.wait_for_timeout(2000)
-        except Exception as e:
-            print(f"[DEBUG] Click giữa thất bại: {e}")
-        
-        # Phương pháp 2: Dùng keyboard
-        try:
-            page.keyboard.press('Space')
-            print("[INFO] Đã nhấn Space để play")
-            page.wait_for_timeout(1000)
-        except:
-            pass
+        wait_for_capture(page, captured, 5000)
         
-        # Phương pháp 3: Tìm và click các selector
-        play_selectors = [
-            '[aria-label*="Play"]',
-            '[aria-label*="play"]', 
-            '[data-tooltip*="Play"]',
-            '.ytp-play-button',
-            'button[aria-label*="Play"]',
-            '.ndfHFb-c4YZDc-Wrber',
-            'video',
-            '.ndfHFb-c4YZDc',  # Video container
-        ]
+        if not captured.is_set():
+            # Thử click vào video để play - nhiều phương pháp
+            print("[INFO] Đang thử click play...")
+            clicked = False
         
-        for selector in play_selectors:
+            # Phương pháp 1: Click vào giữa màn hình (vị trí nút play)
             try:
-                element = page.query_selector(selector)
-                if element:
-                    element.click()
-                    print(f"[INFO] Đã click vào selector: {selector}")
-                    clicked = True
-                    page.wait_for_timeout(1000)
-                    break
+                page.mouse.click(640, 390)  # Click vào giữa video
+                print("[INFO] Đã click vào giữa video")
+                clicked = True
+                page.wait_for_timeout(2000)
             except Exception as e:
-                continue
+                print(f"[DEBUG] Click giữa thất bại: {e}")
         
-        if not clicked:
-            print("[WARNING] Không thể click play tự động")
+            # Phương pháp 2: Dùng keyboard
+            try:
+                page.keyboard.press('Space')
+                print("[INFO] Đã nhấn Space để play")
+                page.wait_for_timeout(1000)
+            except:
+                pass
         
-        # Đợi network requests
-        print(f"[INFO] Đang đợi {wait_time/1000}s để bắt video URLs...")
-        page.wait_for_timeout(wait_time)
+            # Phương pháp 3: Tìm và click các selector
+            play_selectors = [
+                '[aria-label*="Play"]',
+                '[aria-label*="play"]', 
+                '[data-tooltip*="Play"]',
+                '.ytp-play-button',
+                'button[aria-label*="Play"]',
+                '.ndfHFb-c4YZDc-Wrber',
+                'video',
+                '.ndfHFb-c4YZDc',  # Video container
+            ]
         
-        # Thử scroll để trigger load thêm
-        try:
-            page.mouse.move(960, 540)
-            page.mouse.wheel(0, 100)
-        except:
-            pass
+            for selector in play_selectors:
+                try:
+                    element = page.query_selector(selector)
+                    if element:
+                        element.click()
+                        print(f"[INFO] Đã click vào selector: {selector}")
+                        clicked = True
+                        page.wait_for_timeout(1000)
+                        break
+                except Exception as e:
+                    continue
+        
+            if not clicked:
+                print("[WARNING] Không thể click play tự động")
         
-        page.wait_for_timeout(3000)
+        # Đợi network requests, dừng ngay khi bắt được URL video
+        if not captured.is_set():
+            print(f"[INFO] Đang đợi tối đa {wait_time/1000}s để bắt video URLs...")
+            wait_for_capture(page, captured, wait_time)
+        
+        if not captured.is_set():
+            # Thử scroll để trigger load thêm
+            try:
+                page.mouse.move(960, 540)
+                page.mouse.wheel(0, 100)
+            except:
+                pass
+            wait_for_capture(page, captured, 3000)
         
         # Nếu visible mode và chưa bắt được URL, đợi user click play
         if not headless and len(video_urls) == 0:
@@ -257,16 +493,82 @@ def capture_video_url(
             print("[INFO] Đang đợi thêm 10s để bắt URL...")
             page.wait_for_timeout(10000)
         
-        # Đóng browser
-        browser.close()
+        # Đóng tab, context được trả về pool
+        page.close()
     
     return video_urls
 
 
+def probe_range_size(video_url: str, headers: dict) -> int:
+    """Tổng dung lượng nếu server hỗ trợ Range (206 + Content-Range), ngược lại 0"""
+    try:
+        response = _SESSION.get(
+            video_url, headers={**headers, 'Range': 'bytes=0-0'}, stream=True, timeout=30
+        )
+    except requests.RequestException:
+        return 0
+    with response:
+        total = response.headers.get('content-range', '').rpartition('/')[2]
+        if response.status_code != 206 or not total.isdigit():
+            return 0
+        return int(total)
+
+
+def _fetch_range(video_url: str, headers: dict, output_path: str, start: int, end: int, on_chunk) -> bool:
+    """Tải bytes [start, end] ghi thẳng vào vị trí tương ứng trong file (handle riêng mỗi luồng)"""
+    response = _SESSION.get(
+        video_url, headers={**headers, 'Range': f'bytes={start}-{end}'}, stream=True, timeout=60
+    )
+    with response:
+        if response.status_code != 206:
+            return False
+        written = 0
+        with open(output_path, 'r+b') as f:
+            f.seek(start)
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+                on_chunk(len(chunk))
+    return written == end - start + 1
+
+
+def download_ranges(video_url: str, output_path: str, headers: dict, total_size: int,
+                    parts: int = PARALLEL_RANGES) -> bool:
+    """Chia file thành `parts` đoạn, tải song song bằng Range vào file đã cấp phát sẵn"""
+    with open(output_path, 'wb') as f:
+        f.truncate(total_size)
+
+    bounds = [(i * total_size // parts, (i + 1) * total_size // parts - 1) for i in range(parts)]
+    downloaded = [0]
+    lock = threading.Lock()
+
+    def on_chunk(n):
+        with lock:
+            downloaded[0] += n
+
+    with ThreadPoolExecutor(max_workers=parts) as executor:
+        futures = [
+            executor.submit(_fetch_range, video_url, headers, output_path, start, end, on_chunk)
+            for start, end in bounds
+        ]
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=PROGRESS_INTERVAL)
+            percent = downloaded[0] / total_size * 100
+            print(f"\r[DOWNLOAD] {percent:.1f}% ({downloaded[0] / 1024 / 1024:.1f} MB, {parts} luồng)", end='')
+
+    try:
+        return all(f.result() for f in futures)
+    except Exception as e:
+        print(f"\n[WARN] Lỗi tải đoạn: {e}")
+        return False
+
+
 def download_video(
     video_url: str,
     output_path: str = 'downloaded_video.mp4',
-    cookie_file: str = 'drive.google.com_cookies.txt'
+    cookie_file: str = 'drive.google.com_cookies.txt',
+    extra_cookies: list[dict] | None = None
 ) -> bool:
     """
     Tải video từ URL videoplayback
@@ -275,28 +577,39 @@ def download_video(
         video_url: URL của video (từ capture_video_url)
         output_path: Đường dẫn file output
         cookie_file: File cookies để authenticate
+        extra_cookies: Cookies bổ sung đi kèm URL (vd. DRIVE_STREAM từ get_video_info)
     
     Returns:
         True nếu tải thành công
     """
     print(f"[INFO] Đang tải video về: {output_path}")
     
-    # Load cookies cho requests
-    cookies = parse_netscape_cookies(cookie_file)
-    cookie_dict = {c['name']: c['value'] for c in cookies if 'google.com' in c['domain']}
+    # Load cookies cho requests (theo domain; cookie kèm URL không có domain thì gắn với host của URL)
+    host = urlparse(video_url).hostname or ''
+    set_session_cookies(google_cookies(cookie_file) + [
+        {**c, 'domain': c.get('domain') or host} for c in extra_cookies or ()
+    ])
     
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'User-Agent': USER_AGENT,
         'Referer': 'https://drive.google.com/',
         'Accept': '*/*',
         'Accept-Language': 'en-US,en;q=0.9',
     }
     
     try:
-        response = requests.get(
+        # Server hỗ trợ Range → tải song song nhiều đoạn, lỗi thì quay về tải 1 luồng
+        if PARALLEL_RANGES > 1:
+            total_size = probe_range_size(video_url, headers)
+            if total_size >= MIN_PARALLEL_SIZE:
+                if download_ranges(video_url, output_path, headers, total_size):
+                    print(f"\n[SUCCESS] Đã tải xong: {output_path}")
+                    return True
+                print("\n[WARN] Tải song song thất bại, chuyển sang tải 1 luồng")
+
+        response = _SESSION.get(
             video_url,
             headers=headers,
-            cookies=cookie_dict,
             stream=True,
             timeout=60
         )
@@ -304,18 +617,25 @@ def download_video(
         if response.status_code == 200:
             total_size = int(response.headers.get('content-length', 0))
             downloaded = 0
+            last_print = 0.0
             
-            with open(output_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+            with open(output_path, 'wb', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+                if hasattr(os, 'posix_fadvise'):  # Linux: báo kernel ghi tuần tự
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     if chunk:
                         f.write(chunk)
                         downloaded += len(chunk)
                         
-                        # Progress indicator
-                        if total_size > 0:
+                        # Progress indicator (throttle để không nghẽn stdout)
+                        now = time.monotonic()
+                        if total_size > 0 and now - last_print >= PROGRESS_INTERVAL:
                             percent = (downloaded / total_size) * 100
                             print(f"\r[DOWNLOAD] {percent:.1f}% ({downloaded / 1024 / 1024:.1f} MB)", end='')
+                            last_print = now
             
+            if total_size > 0:
+                print(f"\r[DOWNLOAD] {downloaded / total_size * 100:.1f}% ({downloaded / 1024 / 1024:.1f} MB)", end='')
             print(f"\n[SUCCESS] Đã tải xong: {output_path}")
             return True
         else:
@@ -391,7 +711,8 @@ def main():
     
     # Tải video (ưu tiên video, không phải audio)
     video_only = [v for v in video_urls if v['type'] == 'video']
-    url_to_download = video_only[0]['url'] if video_only else video_urls[0]['url']
+    chosen = video_only[0] if video_only else video_urls[0]
+    url_to_download = chosen['url']
     
     # Tạo tên output từ file ID
     file_id = extract_file_id(gdrive_url)
@@ -401,7 +722,8 @@ def main():
     success = download_video(
         video_url=url_to_download,
         output_path=output_name,
-        cookie_file=cookie_file
+        cookie_file=cookie_file,
+        extra_cookies=chosen.get('cookies')
     )
     
     if success:
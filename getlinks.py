@@ -10,13 +10,31 @@ import subprocess
 import sys
 import shutil
 import os
+import threading
 import time
+from collections import deque
+
+try:
+    import orjson  # tùy chọn — JSON codec viết bằng C, nhanh hơn nhiều với cây lớn
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard  # tùy chọn — ghi output.json.zst khi bật OUTPUT_ZSTD (nén ~5×)
+except ImportError:
+    zstandard = None
+
+json_loads = orjson.loads if orjson is not None else json.loads
 
 # ============== CẤU HÌNH ==============
 REMOTE_NAME = "getlink:"
 FOLDER_ID = os.environ.get("FOLDER_ID", "1yL-lpT9TKX06AX2c0dhZGji78gy8Mv3F")
+ROOT_NAME = os.environ.get("ROOT_NAME", "")  # Tên folder gốc đặt từ UI (bỏ qua tra cứu)
 OUTPUT_FILE = "output.json"
 TIMEOUT_SECONDS = 7200  # 2 giờ
+OUTPUT_ZSTD = os.environ.get("OUTPUT_ZSTD", "") == "1"  # opt-in: ghi output.json.zst thay vì output.json
+ZSTD_LEVEL = 3  # mức nén khi bật OUTPUT_ZSTD
+STDERR_TAIL = 200  # số dòng stderr cuối của rclone giữ lại để báo lỗi
 # =======================================
 
 
@@ -134,127 +152,180 @@ def fetch_drive_data(rclone_path):
             text=False,  # binary mode
         )
 
-        # Đọc stdout theo chunks
-        stdout_data = b""
-        while True:
-            # Kiểm tra timeout
-            elapsed = time.time() - start_time
-            if elapsed > TIMEOUT_SECONDS:
-                process.kill()
-                print(f"\n❌ Timeout sau {elapsed:.0f}s!")
-                sys.exit(1)
-
-            # Đọc data
-            chunk = process.stdout.read(65536)  # 64KB chunks
-            if not chunk:
-                break
-            stdout_data += chunk
-
-            # Hiển thị progress
-            elapsed = time.time() - start_time
-            size_mb = len(stdout_data) / (1024 * 1024)
-            print(f"\r   📥 Đã nhận: {size_mb:.1f} MB | Thời gian: {elapsed:.0f}s", end="", flush=True)
+        # Đọc stderr ở thread riêng để rclone không bị kẹt khi pipe stderr đầy
+        # (selectors không dùng được với pipe trên Windows). Chỉ giữ STDERR_TAIL
+        # dòng cuối; dòng ERROR được in ngay khi nhận.
+        stderr_tail = deque(maxlen=STDERR_TAIL)
+
+        def drain_stderr():
+            for err_line in process.stderr:
+                stderr_tail.append(err_line)
+                if b"ERROR" in err_line:
+                    print(f"\n   ⚠️  {err_line.decode('utf-8', errors='replace').rstrip()}", flush=True)
+
+        stderr_thread = threading.Thread(target=drain_stderr, daemon=True)
+        stderr_thread.start()
+
+        # Timeout: kill rclone từ timer, vòng đọc bên dưới sẽ tự kết thúc
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(TIMEOUT_SECONDS, on_timeout)
+        timer.daemon = True
+        timer.start()
+
+        # rclone lsjson in mỗi item trên 1 dòng: "[", "{...},", ..., "{...}", "]"
+        # → parse từng dòng ngay khi nhận, không giữ toàn bộ JSON trong bộ nhớ
+        items = []
+        received = 0
+        last_print = 0.0
+        for line in process.stdout:
+            received += len(line)
+            line = line.strip()
+            if line in (b"[", b"]", b""):
+                continue
+            if line.endswith(b","):
+                line = line[:-1]
+            items.append(json_loads(line))
+
+            # Hiển thị progress (tối đa 2 lần/giây)
+            now = time.time()
+            if now - last_print >= 0.5:
+                last_print = now
+                size_mb = received / (1024 * 1024)
+                print(f"\r   📥 Đã nhận: {size_mb:.1f} MB | {len(items)} items | Thời gian: {now - start_time:.0f}s", end="", flush=True)
 
         process.wait()
+        timer.cancel()
+        stderr_thread.join()
         elapsed = time.time() - start_time
 
+        if timed_out.is_set():
+            print(f"\n❌ Timeout sau {elapsed:.0f}s!")
+            sys.exit(1)
+
         print(f"\n   ⏱️  Tổng thời gian quét: {elapsed:.1f}s")
 
         if process.returncode != 0:
-            stderr = process.stderr.read().decode("utf-8", errors="replace")
+            stderr = b"".join(stderr_tail).decode("utf-8", errors="replace")
             print(f"❌ Rclone lỗi (exit code {process.returncode}):\n{stderr}")
             sys.exit(1)
 
-        # Parse JSON
-        json_str = stdout_data.decode("utf-8")
-        items = json.loads(json_str)
         print(f"✅ Tìm thấy {len(items)} items")
         return items
 
     except json.JSONDecodeError as e:
         print(f"❌ Lỗi parse JSON: {e}")
-        # Lưu raw output để debug
+        process.kill()
+        # Lưu dòng lỗi để debug
         with open("raw_output.txt", "wb") as f:
-            f.write(stdout_data)
-        print("   Raw output đã lưu vào raw_output.txt")
+            f.write(line)
+        print("   Dòng lỗi đã lưu vào raw_output.txt")
         sys.exit(1)
     except Exception as e:
         print(f"❌ Lỗi: {e}")
         sys.exit(1)
 
 
-def build_tree(items, root_name="Root"):
-    """Chuyển flat list thành nested tree JSON."""
-    root = {
+def dump_indented(obj, pad):
+    """JSON indent 2 của obj, mọi dòng sau dòng đầu được lùi thêm pad (bytes)."""
+    if orjson is not None:
+        raw = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    else:
+        raw = json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return raw.replace(b"\n", b"\n" + pad)
+
+
+def is_within(path, folder):
+    """True nếu path là folder hoặc nằm bên trong folder ("" = gốc)."""
+    return not folder or path == folder or path.startswith(folder + "/")
+
+
+def stream_tree(items, out, root_name="Root"):
+    """
+    Ghi flat list ra out (file binary) dưới dạng nested tree JSON,
+    không dựng cây dict lồng nhau trong bộ nhớ.
+
+    Item được sắp theo từng thành phần của Path → thứ tự DFS, con của mỗi
+    folder theo thứ tự Path. Stack giữ các folder đang mở; gặp item không
+    thuộc folder đỉnh stack thì đóng folder đó.
+    """
+    stats = {"folders": 0, "files": 0, "total_size": 0}
+    # Mỗi phần tử: [path, pad của node, đã ghi con nào chưa]
+    stack = []
+
+    def open_folder(path, node):
+        pad = b"    " * len(stack)
+        header = dump_indented({**node, "children": []}, pad)
+        out.write(pad + header[:-len(b"]\n" + pad + b"}")])  # bỏ "]\n}" → còn '"children": ['
+        stack.append([path, pad, False])
+
+    def close_folder():
+        _, pad, has_children = stack.pop()
+        if has_children:
+            out.write(b"\n" + pad + b"  ]\n" + pad + b"}")
+        else:
+            out.write(b"]\n" + pad + b"}")
+
+    def begin_child():
+        top = stack[-1]
+        out.write(b",\n" if top[2] else b"\n")
+        top[2] = True
+
+    open_folder("", {
         "name": root_name,
         "type": "folder",
         "id": FOLDER_ID,
         "link": make_link(FOLDER_ID, True),
-        "children": []
-    }
-
-    path_index = {"": root}
-    items.sort(key=lambda x: x["Path"])
-    stats = {"folders": 0, "files": 0, "total_size": 0}
+    })
 
-    for item in items:
+    for item in sorted(items, key=lambda it: it["Path"].split("/")):
         path = item["Path"]
         is_dir = item.get("IsDir", False)
         item_id = item.get("ID", "")
-        name = item.get("Name", path.split("/")[-1])
-        size = item.get("Size", 0)
-        mime_type = item.get("MimeType", "")
+        parent_path, _, base_name = path.rpartition("/")
+
+        # Đóng các folder không phải tổ tiên của item
+        while not is_within(parent_path, stack[-1][0]):
+            close_folder()
+
+        # Folder giả (không có ID) nếu rclone thiếu entry của folder cha
+        if parent_path != stack[-1][0]:
+            done = stack[-1][0]
+            rest = parent_path[len(done) + 1:] if done else parent_path
+            for name in rest.split("/"):
+                done = f"{done}/{name}" if done else name
+                begin_child()
+                open_folder(done, {"name": name, "type": "folder", "id": "", "link": ""})
 
         node = {
-            "name": name,
+            "name": item.get("Name", base_name),
             "type": "folder" if is_dir else "file",
             "id": item_id,
             "link": make_link(item_id, is_dir),
         }
 
+        begin_child()
         if is_dir:
-            node["children"] = []
             stats["folders"] += 1
+            open_folder(path, node)
         else:
+            size = item.get("Size", 0)
             node["size"] = size
             node["sizeFormatted"] = format_size(size)
-            node["mimeType"] = mime_type
+            node["mimeType"] = item.get("MimeType", "")
             stats["files"] += 1
             stats["total_size"] += size
+            pad = b"    " * len(stack)
+            out.write(pad + dump_indented(node, pad))
 
-        # Tìm parent path
-        if "/" in path:
-            parent_path = path.rsplit("/", 1)[0]
-        else:
-            parent_path = ""
-
-        # Thêm node vào parent
-        parent_node = path_index.get(parent_path)
-        if parent_node is None:
-            parts = parent_path.split("/")
-            current_path = ""
-            for part in parts:
-                current_path = f"{current_path}/{part}" if current_path else part
-                if current_path not in path_index:
-                    missing_parent = {
-                        "name": part,
-                        "type": "folder",
-                        "id": "",
-                        "link": "",
-                        "children": []
-                    }
-                    gp_path = current_path.rsplit("/", 1)[0] if "/" in current_path else ""
-                    if gp_path in path_index:
-                        path_index[gp_path]["children"].append(missing_parent)
-                    path_index[current_path] = missing_parent
-            parent_node = path_index.get(parent_path, root)
-
-        parent_node["children"].append(node)
-
-        if is_dir:
-            path_index[path] = node
+    while stack:
+        close_folder()
 
-    return root, stats
+    return stats
 
 
 def main():
@@ -270,16 +341,30 @@ def main():
         print("⚠️  Folder trống hoặc không có quyền truy cập")
         sys.exit(0)
 
-    print("🔍 Đang lấy tên folder gốc...")
-    root_name = fetch_root_folder_name(rclone_path)
-    print(f"   📂 Tên folder gốc: {root_name}")
+    if ROOT_NAME:
+        root_name = ROOT_NAME
+        print(f'📝 Tên folder gốc (đặt từ UI): "{root_name}"')
+    else:
+        print("🔍 Đang lấy tên folder gốc...")
+        root_name = fetch_root_folder_name(rclone_path)
+        print(f"   📂 Tên folder gốc: {root_name}")
 
     print("🌳 Đang xây dựng cây thư mục...")
-    tree, stats = build_tree(items, root_name)
-
     output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), OUTPUT_FILE)
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(tree, f, ensure_ascii=False, indent=2)
+    if OUTPUT_ZSTD and zstandard is None:
+        print("⚠️  OUTPUT_ZSTD=1 nhưng chưa cài zstandard → ghi JSON thường")
+    if OUTPUT_ZSTD and zstandard is not None:
+        # Bật nén → ghi output.json.zst; remove.py / sync_gdrive.py đọc được khi không có output.json
+        with zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(open(output_path + ".zst", "wb")) as f:
+            stats = stream_tree(items, f, root_name)
+        stale_path, output_path = output_path, output_path + ".zst"
+    else:
+        with open(output_path, "wb") as f:
+            stats = stream_tree(items, f, root_name)
+        stale_path = output_path + ".zst"
+    # Xóa bản ở định dạng còn lại để các script sau không đọc nhầm dữ liệu cũ
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
 
     print()
     print("=" * 50)
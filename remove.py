@@ -1,4 +1,16 @@
 import json
+import os
+import re
+
+try:
+    import orjson  # optional — C JSON codec, much faster on a large output.json
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard  # optional — reads/writes output.json.zst (getlinks.py with OUTPUT_ZSTD=1)
+except ImportError:
+    zstandard = None
 
 TARGET_NAMES = [
     "khoahocgiahoi.com website bán khóa học uy tín, chất lượng, giá rẻ.txt",
@@ -15,56 +27,119 @@ INPUT_FILE = "output.json"
 OUTPUT_FILE = "output.json"
 
 
-def remove_target_children(node):
-    """Recursively remove children whose name contains any target string."""
-    if "children" not in node:
-        return 0
-
-    removed = 0
-    original_count = len(node["children"])
-
-    # Filter out children matching the target name
-    node["children"] = [
-        child for child in node["children"]
-        if not any(t in child.get("name", "") for t in TARGET_NAMES)
-    ]
-    removed += original_count - len(node["children"])
+# One alternation regex scans each name once for all targets instead of one `in` per target.
+# An empty list gets no regex (matches nothing) — re.compile("") would match every name.
+_TARGET_RE = re.compile("|".join(map(re.escape, TARGET_NAMES))) if TARGET_NAMES else None
+_REPLACE_RE = re.compile("|".join(map(re.escape, REPLACE_TEXTS))) if REPLACE_TEXTS else None
 
-    # Recurse into remaining children
-    for child in node["children"]:
-        removed += remove_target_children(child)
 
-    return removed
+def _replace_name(node):
+    """Replace matching text in node's name; return 1 if it changed, else 0."""
+    if _REPLACE_RE is None or "name" not in node:
+        return 0
+    new_name, n = _REPLACE_RE.subn(lambda m: REPLACE_TEXTS[m.group(0)], node["name"])
+    if n:
+        node["name"] = new_name
+        return 1
+    return 0
 
 
-def replace_target_text(node):
-    """Recursively replace matching text in children's name field."""
+def _count_replaced_below(node):
+    """Apply the replacements under a removed node, returning how many names changed."""
     count = 0
+    stack = list(node.get("children", ()))
+    while stack:
+        current = stack.pop()
+        count += _replace_name(current)
+        stack.extend(current.get("children", ()))
+    return count
 
-    # Replace in the current node's name
-    if "name" in node:
-        for old_text, new_text in REPLACE_TEXTS.items():
-            if old_text in node["name"]:
-                node["name"] = node["name"].replace(old_text, new_text)
-                count += 1
 
-    # Recurse into children
-    if "children" in node:
-        for child in node["children"]:
-            count += replace_target_text(child)
+def scrub_tree(node):
+    """
+    Replace text in every name and remove (at any depth) children whose
+    name contains any target string, in a single pass.
 
-    return count
+    Children are renamed before the target check, so matching sees the same
+    names as running the replace over the whole tree first. Names inside
+    removed subtrees still count as replaced, as they did in that order.
+    """
+    replaced = _replace_name(node)
+    removed = 0
+    stack = [node]
+
+    # Iterative DFS: no recursion limit on deep trees
+    while stack:
+        current = stack.pop()
+        if "children" not in current:
+            continue
+
+        kept = []
+        for child in current["children"]:
+            replaced += _replace_name(child)
+            if _TARGET_RE is not None and _TARGET_RE.search(child.get("name", "")):
+                removed += 1
+                replaced += _count_replaced_below(child)
+            else:
+                kept.append(child)
+        current["children"] = kept
+
+        # Descend into remaining children
+        stack.extend(kept)
+
+    return replaced, removed
+
+
+def resolve_input(path):
+    """Return path itself when it exists, else path + ".zst" (with a warning) when zstandard can read it."""
+    if not os.path.exists(path) and zstandard is not None and os.path.exists(path + ".zst"):
+        print(f"⚠️  Không có {path} → đọc {path}.zst")
+        return path + ".zst"
+    return path
+
+
+def load_json(path):
+    """Read a JSON file (zstd-compressed when path ends in ".zst"), using orjson when it is installed."""
+    with open(path, "rb") as f:
+        if path.endswith(".zst"):
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                raw = reader.read()
+        else:
+            raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def dump_json(obj, path):
+    """
+    Write obj as 2-space indented UTF-8 JSON, using orjson when it is installed.
+
+    A path ending in ".zst" is written zstd-compressed. The copy in the other
+    format is deleted so readers never pick up a stale tree.
+    """
+    if orjson is not None:
+        raw = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    else:
+        raw = json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    if path.endswith(".zst"):
+        raw = zstandard.ZstdCompressor(level=3).compress(raw)
+        stale_path = path[:-len(".zst")]
+    else:
+        stale_path = path + ".zst"
+    with open(path, "wb") as f:
+        f.write(raw)
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
 
 
 def main():
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    input_path = resolve_input(INPUT_FILE)
+    data = load_json(input_path)
 
-    replaced_count = replace_target_text(data)
-    removed_count = remove_target_children(data)
+    replaced_count, removed_count = scrub_tree(data)
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # Keep the format that was read (plain JSON, or .zst when only the compressed copy exists)
+    dump_json(data, OUTPUT_FILE + ".zst" if input_path.endswith(".zst") else OUTPUT_FILE)
 
     print(f"✅ Đã thay thế text trong {replaced_count} mục")
     print(f"✅ Đã xóa {removed_count} mục chứa các từ khóa target")
@@ -142,7 +142,13 @@ function connectSSE(stepNum, taskId) {
             return;
         }
 
-        // Log entry
+        // Batch of log entries
+        if (data.batch) {
+            addLogLines(stepNum, data.batch);
+            return;
+        }
+
+        // Single log entry
         addLogLine(stepNum, data.type, data.time, data.msg);
     };
 
@@ -162,16 +168,24 @@ function connectSSE(stepNum, taskId) {
 //  LOG DISPLAY
 // ============================================================
 function addLogLine(stepNum, type, time, msg) {
+    addLogLines(stepNum, [{ type, time, msg }]);
+}
+
+function addLogLines(stepNum, entries) {
     const container = document.getElementById(`log-content-${stepNum}`);
-    const line = document.createElement('div');
-    line.className = `log-line ${type}`;
-    line.innerHTML = `
-        <span class="log-time">${time || ''}</span>
-        <span class="log-msg">${escapeHtml(msg)}</span>
-    `;
-    container.appendChild(line);
-
-    // Auto-scroll
+    const fragment = document.createDocumentFragment();
+    for (const entry of entries) {
+        const line = document.createElement('div');
+        line.className = `log-line ${entry.type}`;
+        line.innerHTML = `
+            <span class="log-time">${entry.time || ''}</span>
+            <span class="log-msg">${escapeHtml(entry.msg)}</span>
+        `;
+        fragment.appendChild(line);
+    }
+    container.appendChild(fragment);
+
+    // Auto-scroll once per batch
     container.scrollTop = container.scrollHeight;
 }
 
@@ -308,9 +322,7 @@ async function checkRunningTasks() {
 
             // Render recent logs
             if (task.logs) {
-                for (const entry of task.logs) {
-                    addLogLine(stepNum, entry.type, entry.time, entry.msg);
-                }
+                addLogLines(stepNum, task.logs);
             }
 
             if (task.status === 'running') {
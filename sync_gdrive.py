@@ -3,9 +3,13 @@ Sync Google Drive content from output.json
 
 Flow:
   1. Đọc output.json (cây thư mục/file)
-  2. Folder  → rclone mkdir trên GDrive đích
-  3. video/mp4 → capture_urls.py download → rename → rclone upload → xóa local
-  4. File khác → download qua GDrive URL + cookies Chrome → rclone upload → xóa local
+  2. Folder  → tạo thư mục rỗng trong _stage_upload (cây giống remote)
+  3. video/mp4 → capture_urls.py download → rename → chuyển vào _stage_upload
+  4. File khác → download qua GDrive URL + cookies Chrome → chuyển vào _stage_upload
+     (file ≥ STREAM_MIN_SIZE: stream thẳng vào rclone rcat, không qua đĩa)
+  5. Mỗi UPLOAD_BATCH file (và khi kết thúc) → 1 lệnh rclone copy --files-from-raw → xóa local
+     Folder rỗng được tạo 1 lần khi kết thúc
+  (Folder duyệt tuần tự; file chạy song song trên SYNC_WORKERS luồng, tối đa 4 download tới Drive)
 
 Usage:
   python sync_gdrive.py                    # Chạy bình thường
@@ -13,18 +17,47 @@ Usage:
   python sync_gdrive.py --json other.json  # Dùng file JSON khác
 """
 
+import io
 import json
 import os
 import sys
 import subprocess
 import time
-import glob
 import re
 import argparse
+import secrets
+import shutil
+import socket
+import tempfile
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from requests.cookies import create_cookie
+from urllib3.util.retry import Retry
 from playwright.sync_api import sync_playwright
 
+try:
+    import orjson  # tùy chọn — JSON codec viết bằng C, nhanh hơn nhiều với cây lớn
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard  # tùy chọn — đọc output.json.zst (getlinks.py với OUTPUT_ZSTD=1)
+except ImportError:
+    zstandard = None
+
+try:
+    import ijson  # tùy chọn — parse dần output.json rất lớn thay vì đọc hết vào RAM
+except ImportError:
+    ijson = None
+
+try:
+    import browser_cookie3  # tùy chọn — đọc thẳng SQLite Cookies của Chrome, khỏi mở Chromium
+except ImportError:
+    browser_cookie3 = None
+
 # ===== FIX WINDOWS UNICODE =====
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -35,33 +68,182 @@ RCLONE_PATH = r"C:\Users\phamt\AppData\Local\Microsoft\WinGet\Packages\Rclone.Rc
 REMOTE_NAME = "gdrive:"
 WORK_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMP_DIR = os.path.join(WORK_DIR, "_temp_download")
+STAGE_DIR = os.path.join(WORK_DIR, "_stage_upload")   # cây thư mục giống remote, upload theo lô
 CHROME_USER_DATA = os.path.join(WORK_DIR, 'chrome_profile')
 PROGRESS_FILE = os.path.join(WORK_DIR, "_sync_progress.json")
+JOURNAL_FILE = PROGRESS_FILE + ".jsonl"   # append-only, 1 dòng / thay đổi
+RCLONE_CACHE_FILE = os.path.join(WORK_DIR, "_rclone_cache.json")  # kết quả `rclone version` theo mtime exe
+JOURNAL_COMPACT_EVERY = 10000             # gộp journal vào snapshot sau N dòng
+STREAM_TREE_MIN_SIZE = 256 * 1024 * 1024  # cây JSON lớn hơn → parse dần bằng ijson (nếu có)
 COOKIE_REFRESH_INTERVAL = 600  # 10 phút (giây)
+SYNC_WORKERS = 8               # số file xử lý song song (download + upload)
+UPLOAD_BATCH = 50              # đủ N file staged thì upload 1 lần bằng rclone copy
+UPLOAD_RETRY_DELAY = 60        # giây chờ sau 1 batch lỗi trước khi thử lại (không thử lại mỗi file xong)
+STREAM_MIN_SIZE = 100 * 1024 * 1024  # file (không phải video) từ 100MB → stream thẳng vào rclone rcat
+STREAM_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024  # buffer copyfileobj khi tải file về đĩa
+PROGRESS_INTERVAL = 1.0             # giây giữa 2 lần in tiến độ download
+HTML_ERROR_MAX_SIZE = 1024 * 1024   # response text/html nhỏ hơn mức này = trang lỗi/login
+RCD_START_TIMEOUT = 15         # giây chờ rclone rcd sẵn sàng
+HOST_SEM = {'drive.google.com': threading.Semaphore(4)}  # giới hạn download đồng thời tới Drive
+
+_state_lock = threading.Lock()   # bảo vệ stats + progress giữa các worker
+_cookie_lock = threading.Lock()  # chỉ một worker refresh cookies tại một thời điểm
+_video_lock = threading.Lock()   # capture_urls2.py chạy tuần tự
+_upload_lock = threading.Lock()  # một batch upload tại một thời điểm
+_staged = []                     # [(file_id, staged_path, name, remote_dir)] chờ upload
+_staged_folders = []             # folder remote chờ tạo
+_upload_retry_at = 0.0           # time.monotonic() sớm nhất được flush lại sau batch lỗi
+_resumed_folders = None          # created_folders lúc bắt đầu chạy; None = không có progress → luôn list remote
+_remote_listing_cache = {}       # remote_dir → set(tên file/folder) từ rclone lsf
+_listing_locks = {}              # remote_dir → Lock (list mỗi folder 1 lần)
+_listing_cache_lock = threading.Lock()
+_rcd_proc = None                 # tiến trình `rclone rcd` (None → dùng rclone CLI)
+_rc_url = ''
+_rc_session = None
+_rcd_lock = threading.Lock()     # rclone rcd chỉ khởi động 1 lần, lúc cần list đầu tiên
+_rcd_tried = False
+
+
+# ============================================================
+#  JSON I/O
+# ============================================================
+def load_json(path):
+    """Đọc file JSON (dùng orjson nếu có)."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def tree_file(path):
+    """File cây sẽ đọc: chính path nếu tồn tại, không thì path + '.zst' (nếu có zstandard và file nén)."""
+    if not os.path.exists(path) and zstandard is not None and os.path.exists(path + '.zst'):
+        return path + '.zst'
+    return path
+
+
+def open_tree(path):
+    """Mở cây JSON ở dạng binary, giải nén zstd on-the-fly nếu là file .zst."""
+    if path.endswith('.zst'):
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def load_tree(path):
+    """Đọc cây JSON (file .zst thì giải nén zstd)."""
+    with open_tree(path) as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def read_tree_root(path):
+    """Parse only the root folder's own fields with ijson — stops at its children array."""
+    root = {}
+    with open_tree(path) as f:
+        try:
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if prefix == 'children' and event == 'start_array':
+                    break
+                if prefix and '.' not in prefix and event in ('string', 'number', 'boolean', 'null'):
+                    root[prefix] = value
+        except ijson.JSONError as e:
+            raise json.JSONDecodeError(str(e), '', 0) from e
+    return root
+
+
+def iter_tree_children(path):
+    """Yield the root's children one subtree at a time as ijson parses them."""
+    with open_tree(path) as f:
+        yield from ijson.items(f, 'children.item', use_float=True)
+
+
+def dump_json(obj, path):
+    """Ghi JSON UTF-8 indent 2 (dùng orjson nếu có)."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
 
 
 # ============================================================
 #  PROGRESS TRACKING
 # ============================================================
+# PROGRESS_FILE là snapshot đầy đủ; mỗi thay đổi sau đó chỉ append 1 dòng vào
+# JOURNAL_FILE (O(1)/file). Khi journal đủ JOURNAL_COMPACT_EVERY dòng → ghi
+# snapshot mới + xóa journal.
+_journal_fh = None
+_journal_lines = 0
+
+
 def load_progress():
-    """Load progress from file. Returns dict with 'done_ids' set."""
+    """Load progress snapshot, then replay the journal on top. Returns dict with 'done_ids' set."""
+    progress = {'done_ids': set(), 'failed_ids': set(), 'created_folders': set()}
     if os.path.exists(PROGRESS_FILE):
         try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_json(PROGRESS_FILE)
             progress = {
                 'done_ids': set(data.get('done_ids', [])),
                 'failed_ids': set(data.get('failed_ids', [])),
                 'created_folders': set(data.get('created_folders', [])),
             }
-            return progress
         except Exception:
             pass
-    return {'done_ids': set(), 'failed_ids': set(), 'created_folders': set()}
+    replay_journal(progress)
+    return progress
+
+
+def replay_journal(progress):
+    """Apply JOURNAL_FILE records (one JSON object per line) to the progress sets."""
+    global _journal_lines
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    with open(JOURNAL_FILE, 'r+b') as f:
+        good_end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                # Dòng cuối bị cắt dở khi crash → cắt bỏ để record sau không dính vào
+                f.truncate(good_end)
+                break
+            good_end += len(line)
+            try:
+                rec = orjson.loads(line) if orjson is not None else json.loads(line)
+            except ValueError:
+                continue
+            _journal_lines += 1
+            if 'folder' in rec:
+                progress['created_folders'].add(rec['folder'])
+            elif rec.get('status') == 'done':
+                progress['done_ids'].add(rec['id'])
+                progress['failed_ids'].discard(rec['id'])
+            elif rec.get('status') == 'failed':
+                progress['failed_ids'].add(rec['id'])
+
+
+def append_journal(progress, rec):
+    """Append one record to the journal + fsync (caller holds _state_lock)."""
+    global _journal_fh, _journal_lines
+    try:
+        if _journal_fh is None:
+            _journal_fh = open(JOURNAL_FILE, 'ab')
+        if orjson is not None:
+            _journal_fh.write(orjson.dumps(rec) + b'\n')
+        else:
+            _journal_fh.write(json.dumps(rec, ensure_ascii=False).encode('utf-8') + b'\n')
+        _journal_fh.flush()
+        os.fsync(_journal_fh.fileno())
+    except OSError as e:
+        log("WARN", f"Không ghi được journal: {e}")
+        return
+    _journal_lines += 1
+    if _journal_lines >= JOURNAL_COMPACT_EVERY:
+        save_progress(progress)
 
 
 def save_progress(progress):
-    """Save progress to file (atomic write to prevent corruption)."""
+    """Write a full snapshot (atomic rename) and truncate the journal it supersedes."""
+    global _journal_fh, _journal_lines
     data = {
         'done_ids': sorted(list(progress['done_ids'])),
         'failed_ids': sorted(list(progress['failed_ids'])),
@@ -72,8 +254,7 @@ def save_progress(progress):
     }
     tmp_path = PROGRESS_FILE + '.tmp'
     try:
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        dump_json(data, tmp_path)
         # Atomic rename (Windows: replace if exists)
         if os.path.exists(PROGRESS_FILE):
             os.replace(tmp_path, PROGRESS_FILE)
@@ -81,6 +262,18 @@ def save_progress(progress):
             os.rename(tmp_path, PROGRESS_FILE)
     except Exception as e:
         log("WARN", f"Không lưu được progress: {e}")
+        return
+
+    # Snapshot đã chứa mọi record → journal không còn cần
+    try:
+        if _journal_fh is not None:
+            _journal_fh.close()
+            _journal_fh = None
+        if os.path.exists(JOURNAL_FILE):
+            os.remove(JOURNAL_FILE)
+        _journal_lines = 0
+    except OSError as e:
+        log("WARN", f"Không xóa được journal: {e}")
 
 
 # ============================================================
@@ -95,7 +288,7 @@ def log(level, msg):
         "VID": "🎬", "FILE": "📄",
     }
     icon = icons.get(level, "•")
-    print(f"[{ts}] {icon} {msg}")
+    print(f"[{ts}] {icon} {msg}\n", end="")  # một lần write → không xen dòng giữa các worker
 
 
 def log_progress(stats):
@@ -108,7 +301,7 @@ def log_progress(stats):
     bar_len = 20
     filled = int(bar_len * done / total) if total > 0 else 0
     bar = "█" * filled + "░" * (bar_len - filled)
-    print(f"\n  [{bar}] {pct:.0f}%  ({done}/{total})  skip={skip}  fail={fail}\n")
+    print(f"\n  [{bar}] {pct:.0f}%  ({done}/{total})  skip={skip}  fail={fail}\n\n", end="")
 
 
 # ============================================================
@@ -118,6 +311,22 @@ def ensure_rclone_path():
     """Add rclone to PATH if needed, verify it works"""
     if RCLONE_PATH not in os.environ.get('PATH', ''):
         os.environ['PATH'] = os.environ.get('PATH', '') + ";" + RCLONE_PATH
+
+    # rclone.exe không đổi (cùng path + mtime) → dùng lại version đã cache, khỏi fork rclone
+    rclone_exe = shutil.which('rclone')
+    try:
+        mtime = os.stat(rclone_exe).st_mtime if rclone_exe else None
+    except OSError:
+        mtime = None
+    if mtime is not None:
+        try:
+            cached = load_json(RCLONE_CACHE_FILE)
+            if cached.get('path') == rclone_exe and cached.get('mtime') == mtime:
+                log("OK", f"rclone ready: {cached['version']}")
+                return True
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
     try:
         result = subprocess.run(
             ['rclone', 'version'], capture_output=True, text=True, timeout=10
@@ -125,6 +334,12 @@ def ensure_rclone_path():
         if result.returncode == 0:
             version_line = result.stdout.strip().split('\n')[0]
             log("OK", f"rclone ready: {version_line}")
+            if mtime is not None:
+                try:
+                    dump_json({'path': rclone_exe, 'mtime': mtime, 'version': version_line},
+                              RCLONE_CACHE_FILE)
+                except OSError:
+                    pass
             return True
     except Exception:
         pass
@@ -132,7 +347,81 @@ def ensure_rclone_path():
     return False
 
 
-def run_rclone(args, dry_run=False):
+def start_rcd():
+    """Start `rclone rcd` on a free localhost port; returns True once it answers rc/noop"""
+    global _rcd_proc, _rc_url, _rc_session
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    _rc_url = f'http://127.0.0.1:{port}/'
+    _rc_session = requests.Session()  # riêng, không mang cookies Google của _SESSION
+    # User/pass ngẫu nhiên mỗi lần chạy: process khác trên máy không gọi được
+    # operations/deletefile, purge... lên remote. Truyền qua env để không lộ trên command line
+    _rc_session.auth = ('sync', secrets.token_urlsafe(24))
+    env = {**os.environ, 'RCLONE_RC_USER': _rc_session.auth[0], 'RCLONE_RC_PASS': _rc_session.auth[1]}
+    try:
+        proc = subprocess.Popen(
+            ['rclone', 'rcd', f'--rc-addr=127.0.0.1:{port}'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+        )
+    except Exception as e:
+        log("WARN", f"Không chạy được rclone rcd: {e}")
+        return False
+
+    deadline = time.monotonic() + RCD_START_TIMEOUT
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            _rc_session.post(_rc_url + 'rc/noop', json={}, timeout=2).raise_for_status()
+            _rcd_proc = proc
+            log("OK", f"rclone rcd sẵn sàng: {_rc_url}")
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    proc.kill()
+    log("WARN", "rclone rcd không phản hồi — dùng rclone CLI")
+    return False
+
+
+def stop_rcd():
+    """Terminate the rclone rcd daemon if it is running"""
+    global _rcd_proc
+    if _rcd_proc is not None:
+        _rcd_proc.terminate()
+        try:
+            _rcd_proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _rcd_proc.kill()
+        _rcd_proc = None
+
+
+def ensure_rcd():
+    """Start rclone rcd on first use (at most one attempt per run); True if it is running"""
+    global _rcd_tried
+    with _rcd_lock:
+        if not _rcd_tried:
+            _rcd_tried = True
+            start_rcd()
+    return _rcd_proc is not None
+
+
+class RcError(RuntimeError):
+    """Error answer from rclone rcd; status is the HTTP status code (404 = not found)"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def rc_call(command, **params):
+    """POST a JSON-RPC command to the rclone rcd daemon; raises RcError on rclone/HTTP error"""
+    response = _rc_session.post(_rc_url + command, json=params, timeout=120)
+    if response.status_code != 200:
+        raise RcError(response.status_code, f"rc {command}: {response.text.strip()[:200]}")
+    return response.json()
+
+
+def run_rclone(args, dry_run=False, timeout=600):
     """Run rclone command, return True on success"""
     cmd = ['rclone'] + args
     cmd_str = ' '.join(f'"{a}"' if ' ' in a else a for a in cmd)
@@ -143,97 +432,290 @@ def run_rclone(args, dry_run=False):
 
     log("INFO", f"$ {cmd_str}")
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        # stdout không dùng → DEVNULL; stderr giữ bytes, chỉ decode đoạn cuối khi lỗi
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                timeout=timeout)
         if result.returncode != 0:
-            stderr = result.stderr.strip()[:200]
+            stderr = result.stderr.strip()[-200:].decode('utf-8', 'replace')
             log("ERR", f"rclone error: {stderr}")
             return False
         return True
     except subprocess.TimeoutExpired:
-        log("ERR", "rclone timeout (10 min)")
+        log("ERR", f"rclone timeout ({timeout // 60} min)")
         return False
     except Exception as e:
         log("ERR", f"rclone exception: {e}")
         return False
 
 
-def create_folder(remote_path, dry_run=False):
-    """Create folder on remote via rclone mkdir"""
-    log("DIR", f"mkdir → {REMOTE_NAME}{remote_path}")
-    return run_rclone(['mkdir', f'{REMOTE_NAME}{remote_path}'], dry_run)
+def list_remote_dir(remote_dir):
+    """Names in a remote folder (1 rc list / rclone lsf, cached per folder).
+
+    A missing folder is cached as empty; any other error returns an uncached
+    empty set, so the next file in that folder lists it again.
+    """
+    with _listing_cache_lock:
+        dir_lock = _listing_locks.setdefault(remote_dir, threading.Lock())
+    # Khóa theo folder: các file cùng folder chạy song song chỉ list 1 lần
+    with dir_lock:
+        names = _remote_listing_cache.get(remote_dir)
+        if names is not None:
+            return names
+        try:
+            if ensure_rcd():
+                # rclone rcd đang chạy → 1 RPC, không fork rclone
+                try:
+                    entries = rc_call('operations/list', fs=REMOTE_NAME, remote=remote_dir)['list']
+                except RcError as e:
+                    if e.status != 404:
+                        raise
+                    entries = []  # folder chưa có trên remote
+                names = {e['Name'] + '/' if e.get('IsDir') else e['Name'] for e in entries}
+            else:
+                result = subprocess.run(
+                    ['rclone', 'lsf', f'{REMOTE_NAME}{remote_dir}/'],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=30
+                )
+                if result.returncode == 3:  # exit 3 = directory not found
+                    names = set()
+                elif result.returncode == 0:
+                    # rclone luôn in UTF-8 — decode 1 lần, không phụ thuộc code page Windows
+                    names = set(result.stdout.decode('utf-8', 'replace').splitlines())
+                else:
+                    return set()
+        except Exception as e:
+            log("WARN", f"Không list được {REMOTE_NAME}{remote_dir}: {e}")
+            return set()
+        _remote_listing_cache[remote_dir] = names
+    return names
+
+
+def remember_remote_file(remote_dir, filename):
+    """Record a just-uploaded file in the listing cache instead of re-listing the folder"""
+    with _listing_cache_lock:
+        names = _remote_listing_cache.get(remote_dir)
+        if names is not None:
+            names.add(filename)
 
 
 def file_exists_remote(remote_dir, filename, dry_run=False):
     """Check if a file already exists on remote (for resume)"""
     if dry_run:
         return False
-    try:
-        result = subprocess.run(
-            ['rclone', 'lsf', f'{REMOTE_NAME}{remote_dir}/'],
-            capture_output=True, text=True, timeout=30
-        )
-        if result.returncode == 0:
-            remote_files = result.stdout.strip().split('\n')
-            return filename in remote_files
-    except Exception:
-        pass
-    return False
+    return filename in list_remote_dir(remote_dir)
 
 
-def upload_and_cleanup(local_path, remote_dir, dry_run=False):
-    """Upload file via rclone copy, then delete local file"""
-    filename = os.path.basename(local_path)
-    log("UP", f"Upload: {filename} → {REMOTE_NAME}{remote_dir}/")
+def stage_path_for(remote_dir, filename=''):
+    """Local path mirroring REMOTE_NAME/<remote_dir>/<filename> under STAGE_DIR"""
+    return os.path.join(STAGE_DIR, *[p for p in remote_dir.split('/') if p], filename)
 
-    success = run_rclone([
-        'copy', local_path, f'{REMOTE_NAME}{remote_dir}', '--progress'
-    ], dry_run)
 
-    if success and not dry_run:
-        try:
-            os.remove(local_path)
-            log("OK", f"Xóa local: {filename}")
-        except Exception as e:
-            log("WARN", f"Không xóa được local: {e}")
+def stage_folder(remote_path, dry_run=False):
+    """Queue a remote folder: created by the next batch upload (--create-empty-src-dirs)"""
+    log("DIR", f"mkdir (batch) → {REMOTE_NAME}{remote_path}")
+    if not dry_run:
+        os.makedirs(stage_path_for(remote_path), exist_ok=True)
+    with _state_lock:
+        _staged_folders.append(remote_path)
+
+
+def stage_file(local_path, remote_dir, file_id, name, stats, progress, dry_run=False):
+    """Move a finished download into the stage tree; flush once UPLOAD_BATCH files are waiting"""
+    staged_path = stage_path_for(remote_dir, os.path.basename(local_path))
+    if not dry_run:
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        shutil.move(local_path, staged_path)
+    with _state_lock:
+        _staged.append((file_id, staged_path, name, remote_dir))
+        pending = len(_staged)
+    # Batch trước lỗi → chờ hết UPLOAD_RETRY_DELAY, không copy lại cả lô sau mỗi file xong
+    if pending >= UPLOAD_BATCH and time.monotonic() >= _upload_retry_at:
+        flush_uploads(stats, progress, dry_run)
+
+
+def upload_batch(batch, dry_run=False):
+    """rclone copy of exactly the batch's staged files (relative paths via --files-from-raw)"""
+    log("UP", f"Upload batch: {len(batch)} files → {REMOTE_NAME}")
+    rel_paths = [os.path.relpath(staged_path, STAGE_DIR).replace(os.sep, '/')
+                 for _, staged_path, _, _ in batch]
+    fd, list_path = tempfile.mkstemp(prefix='upload_', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(rel_paths) + '\n')
+        # --no-traverse: chỉ tra đúng các file trong list, không list cả remote
+        return run_rclone([
+            'copy', STAGE_DIR, REMOTE_NAME, '--files-from-raw', list_path,
+            '--no-traverse', '--transfers=16', '--checkers=32', '--drive-chunk-size=64M',
+        ], dry_run, timeout=None)
+    finally:
+        os.remove(list_path)
+
+
+def record_folders(progress, remote_dirs, dry_run=False):
+    """Journal remote folders (and their ancestors) now known to exist; caller holds _state_lock"""
+    if dry_run:
+        return
+    for remote_dir in remote_dirs:
+        parts = remote_dir.split('/')
+        for i in range(1, len(parts) + 1):
+            folder = '/'.join(parts[:i])
+            if folder not in progress['created_folders']:
+                progress['created_folders'].add(folder)
+                append_journal(progress, {'folder': folder})
+
+
+def flush_uploads(stats, progress, dry_run=False, final=False):
+    """Upload the staged files with one rclone copy, then delete local files + record results"""
+    global _upload_retry_at
+    ok = True
+    with _upload_lock:
+        with _state_lock:
+            batch = list(_staged)
+            folders = list(_staged_folders) if final else []
+
+        if batch:
+            ok = upload_batch(batch, dry_run)
+            # Lỗi giữa chừng → giữ nguyên file staged, thử lại sau UPLOAD_RETRY_DELAY giây
+            if not ok and not final:
+                _upload_retry_at = time.monotonic() + UPLOAD_RETRY_DELAY
+                log("WARN", f"Upload batch lỗi — thử lại sau {UPLOAD_RETRY_DELAY}s")
+                return
+            _upload_retry_at = 0.0
+            with _state_lock:
+                # Worker khác có thể đã thêm file trong lúc upload → chỉ bỏ phần đã snapshot
+                del _staged[:len(batch)]
+                # rclone copy đã tạo các folder chứa file → ghi nhận ngay, không đợi cuối lần chạy
+                if ok:
+                    record_folders(progress, {remote_dir for _, _, _, remote_dir in batch}, dry_run)
+
+        if folders:
+            # Folder có file đã được tạo ngầm khi upload; 1 lần copy cấu trúc thư mục cho folder rỗng
+            log("DIR", f"Tạo {len(folders)} folders → {REMOTE_NAME}")
+            folders_ok = run_rclone([
+                'copy', STAGE_DIR, REMOTE_NAME, '--create-empty-src-dirs', '--exclude', '*',
+            ], dry_run, timeout=None)
+            with _state_lock:
+                del _staged_folders[:len(folders)]
+                if folders_ok:
+                    record_folders(progress, folders, dry_run)
+
+    for file_id, staged_path, name, remote_dir in batch:
+        if ok:
+            log("OK", f"✅ Upload xong: {name}")
+            remember_remote_file(remote_dir, os.path.basename(staged_path))
+            if not dry_run:
+                try:
+                    os.remove(staged_path)
+                except Exception as e:
+                    log("WARN", f"Không xóa được local: {e}")
+        else:
+            log("ERR", f"❌ Upload fail: {name}")
+        record_result(stats, progress, file_id, ok, dry_run)
 
-    return success
+
+def cleanup_stage():
+    """Remove empty directories left in STAGE_DIR (bottom-up)"""
+    if not os.path.isdir(STAGE_DIR):
+        return
+    for dirpath, _, _ in os.walk(STAGE_DIR, topdown=False):
+        try:
+            os.rmdir(dirpath)
+        except OSError:
+            pass  # còn file (upload lỗi) → giữ lại
 
 
 # ============================================================
 #  CHROME COOKIES
 # ============================================================
+NETSCAPE_COOKIE_HEADER = (
+    "# Netscape HTTP Cookie File\n"
+    "# https://curl.haxx.se/rfc/cookie_spec.html\n"
+    "# This is a generated file! Do not edit.\n\n"
+)
+GOOGLE_COOKIE_DOMAINS = ('google.com', 'googleusercontent.com')  # domain gốc (kèm subdomain) của cookie cần giữ
+
+
+def is_google_cookie_domain(domain):
+    """True for google.com / googleusercontent.com and their subdomains (not look-alikes like notgoogle.com)"""
+    domain = domain.lstrip('.')
+    return any(domain == d or domain.endswith('.' + d) for d in GOOGLE_COOKIE_DOMAINS)
+
+
+
 def export_cookies_to_file(browser_cookies):
-    """Export browser cookies to Netscape format file for capture_urls2.py"""
+    """Export Google cookies to Netscape format file for capture_urls2.py; returns the Google cookie dicts.
+
+    One pass over browser_cookies builds both the filtered list and the file lines.
+    """
     cookie_file = os.path.join(WORK_DIR, 'drive.google.com_cookies.txt')
+    google_cookies = []
+    lines = []
     try:
+        for c in browser_cookies:
+            domain = c.get('domain', '')
+            if not is_google_cookie_domain(domain):
+                continue
+            name = c.get('name', '')
+            value = c.get('value', '')
+            google_cookies.append(c)
+            lines.append(
+                f"{domain}\t{'TRUE' if domain.startswith('.') else 'FALSE'}\t{c.get('path', '/')}\t"
+                f"{'TRUE' if c.get('secure', False) else 'FALSE'}\t{int(c.get('expires', 0))}\t"
+                f"{name}\t{value}\n"
+            )
         with open(cookie_file, 'w', encoding='utf-8') as f:
-            f.write("# Netscape HTTP Cookie File\n")
-            f.write("# https://curl.haxx.se/rfc/cookie_spec.html\n")
-            f.write("# This is a generated file! Do not edit.\n\n")
-            for c in browser_cookies:
-                domain = c.get('domain', '')
-                if 'google' not in domain:
-                    continue
-                flag = "TRUE" if domain.startswith('.') else "FALSE"
-                path = c.get('path', '/')
-                secure = "TRUE" if c.get('secure', False) else "FALSE"
-                expires = str(int(c.get('expires', 0)))
-                name = c.get('name', '')
-                value = c.get('value', '')
-                f.write(f"{domain}\t{flag}\t{path}\t{secure}\t{expires}\t{name}\t{value}\n")
+            f.write(NETSCAPE_COOKIE_HEADER)
+            f.writelines(lines)
         log("OK", f"Đã cập nhật cookies → {cookie_file}")
     except Exception as e:
         log("ERR", f"Không ghi được cookies file: {e}")
+    return google_cookies
+
+
+def read_profile_cookies():
+    """Read Google cookies straight from the profile's SQLite DB.
+
+    Returns a list of Playwright-style cookie dicts, or None when
+    browser_cookie3 is missing or the DB can't be read/decrypted.
+    """
+    if browser_cookie3 is None:
+        return None
+    profile = os.path.join(CHROME_USER_DATA, 'Default')
+    # Chrome >= 96 để Cookies trong Network/, bản cũ để thẳng trong Default/
+    cookie_db = next((p for p in (os.path.join(profile, 'Network', 'Cookies'),
+                                  os.path.join(profile, 'Cookies')) if os.path.exists(p)), None)
+    if cookie_db is None:
+        return None
+    try:
+        # domain_name lọc kiểu LIKE '%google%' (gồm cả googleusercontent.com), lọc chính xác sau
+        cj = browser_cookie3.chrome(cookie_file=cookie_db, domain_name='google',
+                                    key_file=os.path.join(CHROME_USER_DATA, 'Local State'))
+    except Exception as e:
+        log("WARN", f"Không đọc được Cookies DB ({e}) → dùng Playwright")
+        return None
+    return [{'domain': c.domain, 'path': c.path, 'secure': bool(c.secure),
+             'expires': c.expires or 0, 'name': c.name, 'value': c.value} for c in cj]
+
 
+def get_chrome_cookies(dry_run=False, prefer_db=True):
+    """Extract cookies from the Chrome profile (SQLite DB first, Playwright as fallback).
 
-def get_chrome_cookies(dry_run=False):
-    """Open Playwright once to extract cookies from Chrome profile"""
+    prefer_db=False always goes through Playwright: only a real visit to
+    drive.google.com renews the rotating session cookies — the DB just holds
+    whatever Chrome last wrote.
+    """
     if dry_run:
         log("INFO", "[DRY-RUN] Skip lấy cookies")
-        return {}
+        return []
 
     log("INFO", "Đang lấy cookies từ Chrome profile...")
-    cookies_dict = {}
+    google_cookies = []
+
+    browser_cookies = read_profile_cookies() if prefer_db else None
+    if browser_cookies:
+        google_cookies = export_cookies_to_file(browser_cookies)
+        log("OK", f"Lấy được {len(google_cookies)} cookies từ Cookies DB")
+        return google_cookies
 
     try:
         with sync_playwright() as p:
@@ -251,22 +733,32 @@ def get_chrome_cookies(dry_run=False):
             page.goto('https://drive.google.com', timeout=30000)
             page.wait_for_timeout(3000)
 
-            browser_cookies = context.cookies()
-            for c in browser_cookies:
-                domain = c.get('domain', '')
-                if 'google' in domain:
-                    cookies_dict[c['name']] = c['value']
-
-            # Export cookies ra file cho capture_urls2.py
-            export_cookies_to_file(browser_cookies)
+            # Lọc cookie Google + export ra file cho capture_urls2.py trong 1 lượt
+            google_cookies = export_cookies_to_file(context.cookies())
 
             context.close()
 
-        log("OK", f"Lấy được {len(cookies_dict)} cookies từ Chrome")
+        log("OK", f"Lấy được {len(google_cookies)} cookies từ Chrome")
     except Exception as e:
         log("ERR", f"Lỗi lấy cookies: {e}")
 
-    return cookies_dict
+    return google_cookies
+
+
+def set_session_cookies(google_cookies):
+    """Replace the Google cookies in _SESSION with domain/path-scoped copies.
+
+    Scoped cookies are only sent to matching hosts, and clearing first drops the
+    server-set copies that would otherwise be sent alongside the refreshed ones.
+    """
+    jar = _SESSION.cookies
+    for domain in {c.domain for c in jar if is_google_cookie_domain(c.domain)}:
+        jar.clear(domain)
+    for c in google_cookies:
+        jar.set_cookie(create_cookie(
+            name=c.get('name', ''), value=c.get('value', ''), domain=c.get('domain', ''),
+            path=c.get('path', '/'), secure=bool(c.get('secure', False)),
+        ))
 
 
 def maybe_refresh_cookies(cookie_state, dry_run=False):
@@ -276,9 +768,10 @@ def maybe_refresh_cookies(cookie_state, dry_run=False):
     elapsed = time.time() - cookie_state['last_refresh']
     if elapsed >= COOKIE_REFRESH_INTERVAL:
         log("INFO", f"🔄 Cookies đã {elapsed/60:.0f} phút — đang làm mới...")
-        new_cookies = get_chrome_cookies(dry_run=False)
+        new_cookies = get_chrome_cookies(dry_run=False, prefer_db=False)
         if new_cookies:
             cookie_state['cookies'] = new_cookies
+            set_session_cookies(new_cookies)
             cookie_state['last_refresh'] = time.time()
             log("OK", f"Cookies mới: {len(new_cookies)} cookies")
         else:
@@ -289,83 +782,122 @@ def maybe_refresh_cookies(cookie_state, dry_run=False):
 # ============================================================
 #  DOWNLOAD: NON-VIDEO FILES
 # ============================================================
-def download_file_direct(file_id, file_name, local_path, cookies_dict, dry_run=False):
-    """Download a non-video file from Google Drive via direct URL"""
-    if dry_run:
-        log("DL", f"[DRY-RUN] Download {file_name} (id={file_id})")
-        return True
+def make_session():
+    """Shared session: keep-alive connections + Chrome cookies across files, retry on transient errors"""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-    log("DL", f"Download: {file_name} (id={file_id[:12]}...)")
 
+_SESSION = make_session()
+# Trang cảnh báo virus-scan của Google (file lớn)
+_CONFIRM_RE = re.compile(r'confirm=([0-9A-Za-z_-]+)')
+_UUID_RE = re.compile(r'name="uuid"\s+value="([^"]+)"')
+
+
+def open_drive_download(file_id):
+    """GET the direct-download URL (following Google's virus-scan confirm page); returns a streaming response"""
     url = f"https://drive.google.com/uc?export=download&id={file_id}"
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
     }
 
-    try:
-        session = requests.Session()
-        response = session.get(
-            url, cookies=cookies_dict, headers=headers, stream=True, timeout=120
-        )
-
-        # Handle Google virus-scan confirmation page for large files
-        content_type = response.headers.get('content-type', '')
-        if 'text/html' in content_type:
-            page_text = response.text
+    session = _SESSION
+    response = session.get(
+        url, headers=headers, stream=True, timeout=120
+    )
 
-            # Method 1: confirm token
-            confirm = re.search(r'confirm=([0-9A-Za-z_-]+)', page_text)
-            if confirm:
-                url2 = f"{url}&confirm={confirm.group(1)}"
+    # Handle Google virus-scan confirmation page for large files
+    content_type = response.headers.get('content-type', '')
+    if 'text/html' in content_type:
+        page_text = response.text
+
+        # Method 1: confirm token
+        confirm = _CONFIRM_RE.search(page_text)
+        if confirm:
+            url2 = f"{url}&confirm={confirm.group(1)}"
+            response = session.get(
+                url2, headers=headers,
+                stream=True, timeout=120
+            )
+        else:
+            # Method 2: uuid + confirm=t
+            uuid_m = _UUID_RE.search(page_text)
+            if uuid_m:
+                url2 = f"{url}&uuid={uuid_m.group(1)}&confirm=t"
                 response = session.get(
-                    url2, cookies=cookies_dict, headers=headers,
+                    url2, headers=headers,
                     stream=True, timeout=120
                 )
-            else:
-                # Method 2: uuid + confirm=t
-                uuid_m = re.search(r'name="uuid"\s+value="([^"]+)"', page_text)
-                if uuid_m:
-                    url2 = f"{url}&uuid={uuid_m.group(1)}&confirm=t"
-                    response = session.get(
-                        url2, cookies=cookies_dict, headers=headers,
-                        stream=True, timeout=120
-                    )
-
-        # Stream to disk
+
+    return response
+
+
+class ProgressWriter:
+    """File wrapper for shutil.copyfileobj: counts bytes, prints progress at most every PROGRESS_INTERVAL s"""
+
+    def __init__(self, f, total):
+        self.f = f
+        self.total = total
+        self.written = 0
+        self.last_print = 0.0
+
+    def write(self, data):
+        n = self.f.write(data)
+        self.written += n
+        now = time.monotonic()
+        if self.total > 0 and (now - self.last_print >= PROGRESS_INTERVAL or self.written >= self.total):
+            self.last_print = now
+            pct = self.written / self.total * 100
+            print(
+                f"\r  ⬇️ {self.written // 1024}KB / {self.total // 1024}KB ({pct:.0f}%)",
+                end="", flush=True
+            )
+        return n
+
+
+def download_file_direct(file_id, file_name, local_path, dry_run=False, mime_type=''):
+    """Download a non-video file from Google Drive via direct URL.
+
+    mime_type is the file's own type from the tree; a text/html file is
+    expected to come back as HTML, so it skips the error-page check.
+    """
+    if dry_run:
+        log("DL", f"[DRY-RUN] Download {file_name} (id={file_id})")
+        return True
+
+    log("DL", f"Download: {file_name} (id={file_id[:12]}...)")
+
+    try:
+        response = open_drive_download(file_id)
         total = int(response.headers.get('content-length', 0))
-        downloaded = 0
+        is_html = 'text/html' in response.headers.get('content-type', '')
+
+        # Vẫn là trang HTML nhỏ sau cả 2 lần confirm → trang lỗi/login, không ghi ra đĩa
+        if is_html and mime_type != 'text/html' and total < HTML_ERROR_MAX_SIZE:
+            response.close()
+            log("ERR", f"Nhận được HTML thay vì file — có thể cần login")
+            return False
 
         os.makedirs(os.path.dirname(local_path), exist_ok=True)
 
+        # Stream to disk (copyfileobj: 1MB/lần, progress tối đa 1 lần/giây)
+        response.raw.decode_content = True  # giải nén gzip/deflate như iter_content
+        # File .html: open_drive_download có thể đã đọc hết body để tìm confirm token
+        # → lấy từ response.content (đã cache), không đọc lại raw
+        source = io.BytesIO(response.content) if is_html else response.raw
         with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=65536):
-                if chunk:
-                    f.write(chunk)
-                    downloaded += len(chunk)
-                    if total > 0:
-                        pct = downloaded / total * 100
-                        print(
-                            f"\r  ⬇️ {downloaded // 1024}KB / {total // 1024}KB ({pct:.0f}%)",
-                            end="", flush=True
-                        )
+            writer = ProgressWriter(f, total)
+            shutil.copyfileobj(source, writer, length=DOWNLOAD_BUFFER_SIZE)
 
         if total > 0:
             print()  # newline after progress
 
-        # Verify: check it's not an HTML error page
-        if os.path.exists(local_path):
-            fsize = os.path.getsize(local_path)
-            if fsize < 1000:
-                with open(local_path, 'r', errors='ignore') as f:
-                    head = f.read(500)
-                if '<html' in head.lower():
-                    log("ERR", f"Nhận được HTML thay vì file — có thể cần login")
-                    os.remove(local_path)
-                    return False
-            log("OK", f"Downloaded: {file_name} ({fsize // 1024}KB)")
-            return True
-
-        return False
+        log("OK", f"Downloaded: {file_name} ({writer.written // 1024}KB)")
+        return True
 
     except Exception as e:
         log("ERR", f"Download error: {e}")
@@ -374,9 +906,74 @@ def download_file_direct(file_id, file_name, local_path, cookies_dict, dry_run=F
         return False
 
 
+def stream_file_to_remote(file_id, file_name, remote_dir, dry_run=False, mime_type=''):
+    """Pipe a non-video file from Drive straight into `rclone rcat` — no local copy"""
+    remote_path = f'{REMOTE_NAME}{remote_dir}/{file_name}'
+    if dry_run:
+        log("UP", f"[DRY-RUN] Stream {file_name} (id={file_id}) → rclone rcat {remote_path}")
+        return True
+
+    log("UP", f"Stream: {file_name} (id={file_id[:12]}...) → {remote_path}")
+
+    try:
+        response = open_drive_download(file_id)
+    except Exception as e:
+        log("ERR", f"Download error: {e}")
+        return False
+
+    with response:
+        if response.status_code != 200 or (
+                mime_type != 'text/html' and 'text/html' in response.headers.get('content-type', '')):
+            log("ERR", f"Nhận được HTML thay vì file — có thể cần login")
+            return False
+
+        total = int(response.headers.get('content-length', 0))
+        cmd = ['rclone', 'rcat', remote_path]
+        if total:
+            cmd += ['--size', str(total)]
+
+        # stderr ra file tạm: rclone không bị kẹt khi pipe stderr đầy
+        with tempfile.TemporaryFile() as err:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=err)
+            downloaded = 0
+            try:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    proc.stdin.write(chunk)
+                    downloaded += len(chunk)
+                if total and downloaded != total:
+                    raise IOError(f"thiếu dữ liệu ({downloaded}/{total} bytes)")
+                proc.stdin.close()
+            except Exception as e:
+                # Kill trước khi đóng stdin → rclone không ghi file dở lên remote
+                proc.kill()
+                proc.wait()
+                log("ERR", f"Stream error: {e}")
+                return False
+
+            if proc.wait() != 0:
+                err.seek(0)
+                log("ERR", f"rclone error: {err.read().decode('utf-8', errors='replace').strip()[:200]}")
+                return False
+
+    log("OK", f"Uploaded: {file_name} ({downloaded // 1024}KB)")
+    return True
+
+
 # ============================================================
 #  DOWNLOAD: VIDEO (via capture_urls.py)
 # ============================================================
+def newest_merged(after=0.0):
+    """(mtime, path) of the newest merged_*.mp4 in WORK_DIR newer than `after`; (after, None) if none"""
+    best = (after, None)
+    with os.scandir(WORK_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith('merged_') and entry.name.endswith('.mp4') and entry.is_file():
+                mtime = entry.stat().st_mtime
+                if mtime > best[0]:
+                    best = (mtime, entry.path)
+    return best
+
+
 def download_video(gdrive_link, file_name, local_dir, dry_run=False):
     """
     Download video by calling capture_urls.py as subprocess.
@@ -389,8 +986,8 @@ def download_video(gdrive_link, file_name, local_dir, dry_run=False):
     log("VID", f"Bắt đầu capture video: {file_name}")
     log("INFO", f"Link: {gdrive_link}")
 
-    # Snapshot merged_*.mp4 files BEFORE running capture
-    existing_merged = set(glob.glob(os.path.join(WORK_DIR, 'merged_*.mp4')))
+    # Mốc mtime của merged_*.mp4 mới nhất TRƯỚC khi capture
+    pre_mtime, _ = newest_merged()
 
     # Run capture_urls.py (let stdout/stderr print directly for debug)
     try:
@@ -410,27 +1007,12 @@ def download_video(gdrive_link, file_name, local_dir, dry_run=False):
         log("ERR", f"capture_urls.py exception: {e}")
         return None
 
-    # Find new merged file
-    current_merged = set(glob.glob(os.path.join(WORK_DIR, 'merged_*.mp4')))
-    new_files = current_merged - existing_merged
-
-    if not new_files:
-        # Fallback: check for any merged file (maybe it existed before but was overwritten)
-        all_merged = sorted(
-            glob.glob(os.path.join(WORK_DIR, 'merged_*.mp4')),
-            key=os.path.getmtime, reverse=True
-        )
-        if all_merged:
-            newest = all_merged[0]
-            mod_time = os.path.getmtime(newest)
-            if time.time() - mod_time < 120:  # modified within last 2 min
-                new_files = {newest}
-
-    if not new_files:
+    # Find new merged file (file mới hoặc file cũ bị ghi đè đều có mtime > mốc)
+    _, merged_file = newest_merged(pre_mtime)
+    if not merged_file:
         log("ERR", "Không tìm thấy file merged sau capture_urls.py")
         return None
 
-    merged_file = list(new_files)[0]
     merged_size = os.path.getsize(merged_file) // 1024 // 1024
     log("OK", f"Tìm thấy: {os.path.basename(merged_file)} ({merged_size}MB)")
 
@@ -439,12 +1021,10 @@ def download_video(gdrive_link, file_name, local_dir, dry_run=False):
     target_path = os.path.join(local_dir, file_name)
 
     try:
-        if os.path.exists(target_path):
-            os.remove(target_path)
-        os.rename(merged_file, target_path)
+        os.replace(merged_file, target_path)  # ghi đè nguyên tử nếu đã tồn tại
         log("OK", f"Rename → {file_name}")
         return target_path
-    except Exception as e:
+    except OSError as e:
         log("WARN", f"Rename failed ({e}), dùng file gốc")
         return merged_file
 
@@ -452,152 +1032,221 @@ def download_video(gdrive_link, file_name, local_dir, dry_run=False):
 # ============================================================
 #  TREE PROCESSING
 # ============================================================
+_SANITIZE_TABLE = str.maketrans({c: '_' for c in '<>:"|?*'})  # Windows-invalid characters
+
+
 def sanitize_name(name):
     """Sanitize folder/file name for Windows paths"""
-    # Replace Windows-invalid characters
-    invalid = '<>:"|?*'
-    for c in invalid:
-        name = name.replace(c, '_')
-    # Remove trailing spaces/dots
-    name = name.rstrip('. ')
-    if not name:
-        name = '_unnamed_'
-    return name
+    # Replace Windows-invalid characters (1 lần translate), remove trailing spaces/dots
+    return name.translate(_SANITIZE_TABLE).rstrip('. ') or '_unnamed_'
 
 
 def count_files(node):
-    """Count total files in tree (recursive)"""
+    """Count total files in tree (iterative — no recursion limit on deep trees)"""
     count = 0
-    if node.get('type') == 'file':
-        count = 1
-    for child in node.get('children', []):
-        count += count_files(child)
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        count += current.get('type') == 'file'
+        stack.extend(current.get('children', ()))
     return count
 
 
-def process_node(node, remote_parent_path, cookie_state, stats, progress, dry_run=False, depth=0):
-    """Recursively process a node from the JSON tree"""
-    indent = "│ " * depth
-    name = node.get('name', 'unknown')
-    node_type = node.get('type', '')
-    mime_type = node.get('mimeType', '')
-    file_id = node.get('id', '')
-    link = node.get('link', '')
-    safe_name = sanitize_name(name)
+def process_node(node, remote_parent_path, cookie_state, stats, progress, executor, futures,
+                 dry_run=False, depth=0):
+    """Walk the JSON tree (iterative pre-order): folders are staged in order, files go to the worker pool"""
+    # (node, remote parent path, depth, dòng log "├─ [i/n]" in trước node)
+    stack = [(node, remote_parent_path, depth, None)]
 
-    # ── FOLDER ──────────────────────────────────────────────
-    if node_type == 'folder':
-        if remote_parent_path:
-            folder_path = f"{remote_parent_path}/{safe_name}"
-        else:
-            folder_path = safe_name
+    while stack:
+        node, remote_parent_path, depth, label = stack.pop()
+        if label:
+            log("INFO", label)
 
-        children = node.get('children', [])
-        child_files = sum(1 for c in children if c.get('type') == 'file')
-        child_dirs = sum(1 for c in children if c.get('type') == 'folder')
+        indent = "│ " * depth
+        name = node.get('name', 'unknown')
+        node_type = node.get('type', '')
+        file_id = node.get('id', '')
 
-        # Skip mkdir if already created in previous run
-        if folder_path in progress['created_folders'] and not dry_run:
-            log("SKIP", f"{indent}📁 {name} (đã tạo)")
-        else:
-            log("DIR", f"{indent}📁 {name}  ({child_files} files, {child_dirs} folders)")
-            create_folder(folder_path, dry_run)
-            if not dry_run:
-                progress['created_folders'].add(folder_path)
-                save_progress(progress)
+        # ── FOLDER ──────────────────────────────────────────────
+        if node_type == 'folder':
+            safe_name = sanitize_name(name)
+            if remote_parent_path:
+                folder_path = f"{remote_parent_path}/{safe_name}"
+            else:
+                folder_path = safe_name
 
-        for i, child in enumerate(children):
-            child_name = child.get('name', '?')
-            log("INFO", f"{indent}├─ [{i + 1}/{len(children)}] {child_name}")
-            process_node(child, folder_path, cookie_state, stats, progress, dry_run, depth + 1)
+            children = node.get('children', [])
+            child_files = sum(1 for c in children if c.get('type') == 'file')
+            child_dirs = sum(1 for c in children if c.get('type') == 'folder')
 
-        return
+            # Skip mkdir if already created in previous run
+            if folder_path in progress['created_folders'] and not dry_run:
+                log("SKIP", f"{indent}📁 {name} (đã tạo)")
+            else:
+                log("DIR", f"{indent}📁 {name}  ({child_files} files, {child_dirs} folders)")
+                stage_folder(folder_path, dry_run)
+
+            # Đẩy ngược để pop ra đúng thứ tự con
+            total = len(children)
+            for i in range(total - 1, -1, -1):
+                child = children[i]
+                stack.append((child, folder_path, depth + 1,
+                              f"{indent}├─ [{i + 1}/{total}] {child.get('name', '?')}"))
+
+        # ── FILE ────────────────────────────────────────────────
+        elif node_type == 'file':
+            with _state_lock:
+                stats['total_files'] += 1
+
+            # Resume check 1: skip if already done in progress file (fastest)
+            if not dry_run and file_id and file_id in progress['done_ids']:
+                log("SKIP", f"{indent}⏭️  {name} (đã xong)")
+                record_skip(stats, progress, None)
+                continue
+
+            # Remote check + download + upload chạy trên worker pool
+            futures.append(executor.submit(
+                process_file, node, remote_parent_path, cookie_state, stats, progress, dry_run, indent
+            ))
+
+
+def process_tree_stream(root, json_path, cookie_state, stats, progress, executor, futures,
+                        dry_run=False):
+    """Like process_node on the root, but top-level subtrees are fed to it as ijson yields them"""
+    name = root.get('name', 'unknown')
+    folder_path = sanitize_name(name)
+    if folder_path in progress['created_folders'] and not dry_run:
+        log("SKIP", f"📁 {name} (đã tạo)")
+    else:
+        log("DIR", f"📁 {name}  (đang parse dần)")
+        stage_folder(folder_path, dry_run)
+
+    for i, child in enumerate(iter_tree_children(json_path), 1):
+        log("INFO", f"├─ [{i}] {child.get('name', '?')}")
+        process_node(child, folder_path, cookie_state, stats, progress, executor, futures,
+                     dry_run, depth=1)
+
+
+def record_skip(stats, progress, file_id):
+    """Count a skipped file (thread-safe); file_id != None → also mark done in progress"""
+    with _state_lock:
+        stats['skipped'] += 1
+        stats['done'] += 1
+        if file_id:
+            progress['done_ids'].add(file_id)
+            append_journal(progress, {'id': file_id, 'status': 'done'})
+        log_progress(stats)
 
-    # ── FILE ────────────────────────────────────────────────
-    if node_type == 'file':
-        stats['total_files'] += 1
 
-        # Resume check 1: skip if already done in progress file (fastest)
-        if not dry_run and file_id and file_id in progress['done_ids']:
-            log("SKIP", f"{indent}⏭️  {name} (đã xong)")
-            stats['skipped'] += 1
+def record_result(stats, progress, file_id, ok, dry_run=False):
+    """Count a finished file (thread-safe) and update progress sets"""
+    with _state_lock:
+        if ok:
             stats['done'] += 1
-            log_progress(stats)
-            return
-
-        # Resume check 2: skip if already on remote (fallback)
-        if not dry_run and file_exists_remote(remote_parent_path, safe_name):
-            log("SKIP", f"{indent}⏭️  {name} (có trên remote)")
-            stats['skipped'] += 1
-            stats['done'] += 1
-            # Also save to progress so next run is faster
-            if file_id:
+        else:
+            stats['failed'] += 1
+        if not dry_run and file_id:
+            if ok:
                 progress['done_ids'].add(file_id)
-                save_progress(progress)
-            log_progress(stats)
-            return
+                progress['failed_ids'].discard(file_id)
+            else:
+                progress['failed_ids'].add(file_id)
+            append_journal(progress, {'id': file_id, 'status': 'done' if ok else 'failed'})
+        log_progress(stats)
 
-        # ── VIDEO/MP4 ──
-        if mime_type == 'video/mp4':
-            log("VID", f"{indent}🎬 {name}  ({node.get('sizeFormatted', '?')})")
 
-            local_path = download_video(link, safe_name, TEMP_DIR, dry_run)
-            if local_path:
-                ok = upload_and_cleanup(local_path, remote_parent_path, dry_run)
-                if ok:
-                    stats['done'] += 1
-                    log("OK", f"{indent}✅ Video done: {name}")
-                    if not dry_run and file_id:
-                        progress['done_ids'].add(file_id)
-                        progress['failed_ids'].discard(file_id)
-                        save_progress(progress)
-                else:
-                    stats['failed'] += 1
-                    log("ERR", f"{indent}❌ Upload fail: {name}")
-                    if not dry_run and file_id:
-                        progress['failed_ids'].add(file_id)
-                        save_progress(progress)
-            else:
-                stats['failed'] += 1
-                log("ERR", f"{indent}❌ Video download fail: {name}")
-                if not dry_run and file_id:
-                    progress['failed_ids'].add(file_id)
-                    save_progress(progress)
+def fetch_video_node(node, safe_name, local_dir, remote_parent_path, cookie_state, dry_run=False, indent=""):
+    """video/mp4: capture_urls2.py → (ok, local path to stage)"""
+    name = node.get('name', 'unknown')
+    log("VID", f"{indent}🎬 {name}  ({node.get('sizeFormatted', '?')})")
+
+    # capture_urls2.py tự chạy đa luồng + nhận diện file merged_*.mp4 theo snapshot → chạy tuần tự
+    with _video_lock, HOST_SEM['drive.google.com']:
+        local_path = download_video(node.get('link', ''), safe_name, local_dir, dry_run)
+    if not local_path:
+        log("ERR", f"{indent}❌ Video download fail: {name}")
+        return False, None
+    log("OK", f"{indent}✅ Video done (chờ upload): {name}")
+    return True, local_path
 
-        # ── OTHER FILE ──
+
+def fetch_other_node(node, safe_name, local_dir, remote_parent_path, cookie_state, dry_run=False, indent=""):
+    """Other files: direct download → (ok, local path to stage); large files are streamed (path None)"""
+    name = node.get('name', 'unknown')
+    file_id = node.get('id', '')
+    log("FILE", f"{indent}📄 {name}  ({node.get('sizeFormatted', '?')}, {node.get('mimeType', '')})")
+
+    # Refresh cookies nếu cần (cookies mới được gắn vào _SESSION)
+    with _cookie_lock:
+        maybe_refresh_cookies(cookie_state, dry_run)
+
+    # File lớn: Drive → rclone rcat trực tiếp, không ghi đĩa, không chờ batch
+    if node.get('size', 0) >= STREAM_MIN_SIZE:
+        with HOST_SEM['drive.google.com']:
+            ok = stream_file_to_remote(file_id, safe_name, remote_parent_path, dry_run,
+                                       mime_type=node.get('mimeType', ''))
+        if ok:
+            log("OK", f"{indent}✅ File done: {name}")
+            remember_remote_file(remote_parent_path, safe_name)
         else:
-            log("FILE", f"{indent}📄 {name}  ({node.get('sizeFormatted', '?')}, {mime_type})")
+            log("ERR", f"{indent}❌ Stream fail: {name}")
+        return ok, None
 
-            os.makedirs(TEMP_DIR, exist_ok=True)
-            local_path = os.path.join(TEMP_DIR, safe_name)
+    os.makedirs(local_dir, exist_ok=True)
+    local_path = os.path.join(local_dir, safe_name)
 
-            # Refresh cookies nếu cần
-            cookies_dict = maybe_refresh_cookies(cookie_state, dry_run)
+    with HOST_SEM['drive.google.com']:
+        ok = download_file_direct(file_id, safe_name, local_path, dry_run,
+                                  mime_type=node.get('mimeType', ''))
+    if not ok:
+        log("ERR", f"{indent}❌ Download fail: {name}")
+        return False, None
+    log("OK", f"{indent}✅ File done (chờ upload): {name}")
+    return True, local_path
 
-            ok = download_file_direct(file_id, safe_name, local_path, cookies_dict, dry_run)
-            if ok:
-                up_ok = upload_and_cleanup(local_path, remote_parent_path, dry_run)
-                if up_ok:
-                    stats['done'] += 1
-                    log("OK", f"{indent}✅ File done: {name}")
-                    if not dry_run and file_id:
-                        progress['done_ids'].add(file_id)
-                        progress['failed_ids'].discard(file_id)
-                        save_progress(progress)
-                else:
-                    stats['failed'] += 1
-                    log("ERR", f"{indent}❌ Upload fail: {name}")
-                    if not dry_run and file_id:
-                        progress['failed_ids'].add(file_id)
-                        save_progress(progress)
-            else:
-                stats['failed'] += 1
-                log("ERR", f"{indent}❌ Download fail: {name}")
-                if not dry_run and file_id:
-                    progress['failed_ids'].add(file_id)
-                    save_progress(progress)
 
-        log_progress(stats)
+# mimeType → handler; mặc định fetch_other_node
+_FETCH_HANDLERS = {
+    'video/mp4': fetch_video_node,
+}
+
+
+def process_file(node, remote_parent_path, cookie_state, stats, progress, dry_run=False, indent=""):
+    """Worker: remote check → download → stage for the next batch upload"""
+    name = node.get('name', 'unknown')
+    file_id = node.get('id', '')
+    safe_name = sanitize_name(name)
+
+    try:
+        # Resume check 2: skip if already on remote (fallback). Có progress thì chỉ list folder
+        # đã ghi nhận từ trước — folder chưa có trong đó được tạo ở lần chạy này nên còn rỗng
+        if (not dry_run
+                and (_resumed_folders is None or remote_parent_path in _resumed_folders)
+                and file_exists_remote(remote_parent_path, safe_name)):
+            log("SKIP", f"{indent}⏭️  {name} (có trên remote)")
+            # Also save to progress so next run is faster
+            record_skip(stats, progress, file_id)
+            return
+
+        # Mỗi file một thư mục tạm riêng → file trùng tên ở các folder khác nhau không đè nhau
+        local_dir = os.path.join(TEMP_DIR, file_id) if file_id else TEMP_DIR
+
+        handler = _FETCH_HANDLERS.get(node.get('mimeType', ''), fetch_other_node)
+        ok, local_path = handler(node, safe_name, local_dir, remote_parent_path, cookie_state, dry_run, indent)
+        if ok and local_path:
+            stage_file(local_path, remote_parent_path, file_id, name, stats, progress, dry_run)
+        else:
+            record_result(stats, progress, file_id, ok, dry_run)
+    except Exception as e:
+        log("ERR", f"{indent}❌ Lỗi xử lý {name}: {e}")
+        record_result(stats, progress, file_id, False, dry_run)
+    finally:
+        if file_id and not dry_run:
+            try:
+                os.rmdir(os.path.join(TEMP_DIR, file_id))
+            except OSError:
+                pass
 
 
 # ============================================================
@@ -632,10 +1281,15 @@ def main():
     # ── Load JSON ──
     json_path = os.path.join(WORK_DIR, args.json)
     log("INFO", f"Đọc {args.json}...")
+    tree_path = tree_file(json_path)
+    if tree_path != json_path:
+        log("WARN", f"Không có {args.json} → đọc bản nén {os.path.basename(tree_path)}")
+    json_path = tree_path
 
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # Cây rất lớn: chỉ đọc root, các nhánh con được parse dần khi xử lý
+        streaming = ijson is not None and os.path.getsize(json_path) >= STREAM_TREE_MIN_SIZE
+        data = read_tree_root(json_path) if streaming else load_tree(json_path)
     except FileNotFoundError:
         log("ERR", f"Không tìm thấy file: {json_path}")
         return
@@ -644,11 +1298,15 @@ def main():
         return
 
     # ── Count files ──
-    total = count_files(data)
-    log("INFO", f"Tổng cộng: {total} files trong cây thư mục")
+    if streaming:
+        log("INFO", "Cây lớn → parse dần bằng ijson, tổng số files đếm trong lúc xử lý")
+    else:
+        total = count_files(data)
+        log("INFO", f"Tổng cộng: {total} files trong cây thư mục")
 
     # ── Get Chrome cookies ──
     cookies = get_chrome_cookies(dry_run)
+    set_session_cookies(cookies)  # gắn 1 lần vào session dùng chung (theo domain), không gửi lại mỗi request
     if not dry_run and not cookies:
         log("WARN", "Không lấy được cookies — download file khác video có thể thất bại")
 
@@ -666,6 +1324,18 @@ def main():
             log("INFO", f"   Progress file: {PROGRESS_FILE}")
         else:
             log("INFO", f"📋 Bắt đầu mới (progress file: {PROGRESS_FILE})")
+        # Journal còn sót từ lần chạy bị dừng giữa chừng → gộp vào snapshot ngay
+        if _journal_lines:
+            log("INFO", f"   Gộp {_journal_lines} dòng journal vào snapshot")
+            save_progress(progress)
+
+    # Progress trống (lần đầu, hoặc file progress bị mất/xóa) → không biết remote đã có gì,
+    # giữ kiểm tra remote cho mọi folder
+    global _resumed_folders
+    if any(progress.values()):
+        _resumed_folders = frozenset(progress['created_folders'])
+    else:
+        _resumed_folders = None
 
     # ── Cookie state (auto-refresh) ──
     cookie_state = {
@@ -685,7 +1355,35 @@ def main():
     start_time = time.time()
     log("INFO", "Bắt đầu xử lý...\n")
 
-    process_node(data, "", cookie_state, stats, progress, dry_run)
+    # rclone rcd (1 tiến trình cho mọi lệnh list) được khởi động ở lần list remote đầu tiên
+    executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS)
+    futures = []
+    try:
+        try:
+            if streaming:
+                try:
+                    process_tree_stream(data, json_path, cookie_state, stats, progress,
+                                        executor, futures, dry_run)
+                except ijson.JSONError as e:
+                    log("ERR", f"JSON không hợp lệ (dừng đọc cây, vẫn hoàn tất phần đã xử lý): {e}")
+            else:
+                process_node(data, "", cookie_state, stats, progress, executor, futures, dry_run)
+            wait(futures)
+        except BaseException:
+            # Ctrl-C / lỗi: bỏ các file còn trong hàng đợi thay vì chờ tải hết rồi mới dừng,
+            # nhưng vẫn upload các file đã staged để không bị bỏ lại trong STAGE_DIR
+            executor.shutdown(wait=False, cancel_futures=True)
+            log("WARN", "⛔ Đang dừng — bỏ các file chưa bắt đầu, upload file đã tải xong (Ctrl-C lần nữa để bỏ qua)")
+            flush_uploads(stats, progress, dry_run, final=True)
+            raise
+        executor.shutdown()
+
+        flush_uploads(stats, progress, dry_run, final=True)
+    finally:
+        stop_rcd()
+        cleanup_stage()
+    if not dry_run:
+        save_progress(progress)
 
     elapsed = time.time() - start_time
 